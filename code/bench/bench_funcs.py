@@ -0,0 +1,183 @@
+"""
+Synthetic fixtures and timing helpers for the offline benchmarks of the pipeline
+"""
+
+import base64
+import io
+import random
+import string
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from PIL import Image, ImageDraw
+
+
+# MEASURE ======================================================================
+
+
+def medir(etapa:str, fn, n_items:int, repeticiones:int=3) -> dict:
+    """
+    Run fn `repeticiones` times and report the best time, the throughput and the peak memory
+    allocated by Python (tracemalloc) during the first run
+    """
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    fn()
+    tiempos = [time.perf_counter() - t0]
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    for _ in range(repeticiones - 1):
+        t0 = time.perf_counter()
+        fn()
+        tiempos.append(time.perf_counter() - t0)
+
+    mejor = min(tiempos)
+    return {'etapa': etapa, 'items': n_items, 'segundos': round(mejor, 4),
+            'items_por_s': round(n_items / mejor, 1), 'pico_mb': round(pico / 2**20, 1)}
+
+
+# FIXTURES =====================================================================
+
+
+def png_bytes(imagen:Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    imagen.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def captcha_png(texto:str, rng:random.Random) -> bytes:
+    """
+    Captcha-like png image: texto over noise lines
+    """
+    imagen = Image.new('RGB', (150, 50), 'white')
+    draw = ImageDraw.Draw(imagen)
+    for _ in range(6):
+        draw.line([(rng.randint(0, 150), rng.randint(0, 50)), (rng.randint(0, 150), rng.randint(0, 50))], fill='gray')
+    draw.text((30, 18), texto, fill='black')
+    return png_bytes(imagen)
+
+
+def captcha_pngs(n:int, seed:int=0) -> list:
+    """
+    n captchas of 5 random characters
+    """
+    rng = random.Random(seed)
+    textos = [''.join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(5)) for _ in range(n)]
+    return [captcha_png(texto, rng) for texto in textos]
+
+
+def positions_sinteticas() -> dict:
+    """
+    Boxes of the fields of the first page, in the layout of `positions.xlsx`
+    """
+    campos = ['institucion', 'cargo', 'civil', 'desde', 'hasta', 'prov', 'ciudad', 'gestion']
+    return {campo: [100, 200 + 80 * i, 1000, 250 + 80 * i] for i, campo in enumerate(campos)}
+
+
+def declaracion_img(positions:dict, seed:int=0) -> Image.Image:
+    """
+    Page of a declaracion with a line of text inside each field of positions
+    """
+    rng = random.Random(seed)
+    imagen = Image.new('L', (1240, 1754), 'white')
+    draw = ImageDraw.Draw(imagen)
+    for campo, (x0, y0, x1, y1) in positions.items():
+        if campo in ('desde', 'hasta'):
+            texto = f"{rng.randint(1990, 2022)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        else:
+            texto = f"{campo.upper()} {rng.choice(['PENAL', 'CIVIL', 'PICHINCHA', 'GUAYAS'])}"
+        draw.text((x0 + 5, y0 + 10), texto, fill='black')
+    return imagen
+
+
+def declaracion_html(n_paginas:int, positions:dict, seed:int=0) -> bytes:
+    """
+    WFDeclaracionTemporal-like page with the pages of a declaracion as base64 images
+    """
+    imgs = []
+    for pagina in range(n_paginas):
+        data = base64.b64encode(png_bytes(declaracion_img(positions, seed + pagina))).decode()
+        imgs.append(f'<div class="pagina"><img id="img{pagina}" src="data:image/png;base64,{data}" /></div>')
+    return f"<html><body><form>{''.join(imgs)}</form></body></html>".encode()
+
+
+def word_boxes_sinteticos(n_palabras:int, seed:int=0) -> tuple:
+    """
+    Words and boxes `[x0, y0, x1, y1]` spread over a page, as returned by `word_boxes`
+    """
+    rng = np.random.default_rng(seed)
+    x0 = rng.integers(0, 1100, n_palabras)
+    y0 = rng.integers(0, 1700, n_palabras)
+    boxes = np.stack([x0, y0, x0 + rng.integers(20, 120, n_palabras), y0 + 30], axis=1)
+    text = np.array([f"w{i}" for i in range(n_palabras)], dtype=object)
+    return text, boxes
+
+
+cargos_base = ['JUEZ DE LO PENAL', 'AGENTE FISCAL', 'SECRETARIO JUDICIAL', 'FISCAL PROVINCIAL',
+               'CONJUEZ NACIONAL', 'ASISTENTE ADMINISTRATIVO', 'PRESIDENTE CORTE PROVINCIAL',
+               'MINISTRO FISCAL', 'AYUDANTE JUDICIAL', 'ABOGADO']
+instituciones_base = ['CONSEJO DE LA JUDICATURA', 'FISCALIA GENERAL DEL ESTADO', 'MINISTERIO PUBLICO',
+                      'CORTE PROVINCIAL DE JUSTICIA', 'TRIBUNAL PENAL', 'MUNICIPIO DE QUITO']
+
+
+def con_errores(texto:str, rng:random.Random) -> str:
+    """
+    Copy of texto with a typo and irregular case/spacing, like the raw cargos
+    """
+    if rng.random() < 0.3:
+        i = rng.randrange(len(texto))
+        texto = texto[:i] + rng.choice(string.ascii_uppercase) + texto[i + 1:]
+    if rng.random() < 0.3:
+        texto = f"  {texto.lower()} "
+    return texto
+
+
+def registros_sinteticos(n:int, n_distintos:int=2000, seed:int=0) -> pd.DataFrame:
+    """
+    Registros like `registros_raw.parquet`, with `n_distintos` distinct cargos repeated over n rows
+    """
+    rng = random.Random(seed)
+    cargos = [con_errores(rng.choice(cargos_base), rng) for _ in range(n_distintos)]
+    instituciones = [con_errores(rng.choice(instituciones_base), rng) for _ in range(n_distintos)]
+    return pd.DataFrame({
+        'cedula': [f"{rng.randint(100000000, 2400000000):010d}" for _ in range(n)],
+        'cargo': [rng.choice(cargos) for _ in range(n)],
+        'institucion': [rng.choice(instituciones) for _ in range(n)],
+        'iddoc': [str(rng.randint(1000, 1500000)) for _ in range(n)],
+        'year': [str(rng.randint(2000, 2023)) for _ in range(n)],
+    })
+
+
+def desde_ocr(rng:random.Random) -> str:
+    """
+    A desde value as read by tesseract: a date with noise, letters instead of digits or garbage
+    """
+    fecha = f"{rng.randint(1975, 2022)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+    caso = rng.random()
+    if caso < 0.5:
+        return fecha
+    if caso < 0.7:
+        return f"{rng.choice(['PENAL', 'NIVEL', 'CANTON'])} | | {fecha}"
+    if caso < 0.8:
+        return fecha.replace('0', 'o', 1).replace('1', 't', 1)
+    if caso < 0.9:
+        return fecha.replace('-', ' ', 1).replace('-', '', 1)
+    return rng.choice(['', 'iver | [aois.orar', 'JUDICATURA | |'])
+
+
+def datosimgs_sinteticos(n_grupos:int, docs_por_grupo:int=5, seed:int=0) -> pd.DataFrame:
+    """
+    Rows like `datosimgs` in `02_clean_fechas.py`: several documents per cedula-cargo
+    """
+    rng = random.Random(seed)
+    filas = []
+    for g in range(n_grupos):
+        cedula, cargo = f"{g:010d}", rng.choice(['juez', 'fiscal'])
+        for _ in range(docs_por_grupo):
+            anio, mes = rng.choice([np.nan, rng.randint(1990, 2015)]), rng.choice([np.nan, rng.randint(1, 12)])
+            filas.append({'cedula': cedula, 'cargo': cargo, 'desde': desde_ocr(rng), 'anio': anio, 'mes': mes,
+                          'fecha_str': rng.choice([None, '201305', '201306', '199811'])})
+    return pd.DataFrame(filas)
@@ -0,0 +1,117 @@
+"""
+Drive the real scraper and image download against `mock_contraloria.py` and report the throughput.
+Run from the root of the project:
+
+    python code/bench/load_test.py scrap --workers 4 --cedulas 40 --p-rechazo 0.2
+    python code/bench/load_test.py imgs --workers 8 --docs 200 --p-error 0.05
+
+`scrap` uses `run_pool` as `02_scrap_contraloria.py` does and reports cedulas/hour, plus the mean
+time of each phase from the timing logs. The captcha is read with `lector_fijo` unless `--trocr`.
+`imgs` uses `fetch_imgs` as `01_process_imgs.py` does and reports declaraciones/hour.
+With `--ritmo` the requests are paced by a `ritmo.Ritmo` that starts at that rate.
+Each run is appended to `data/temp/load_test.jsonl` with its configuration.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+import requests
+from pyprojroot import here
+
+sys.path.append((here()/'code').as_posix())
+sys.path.append((here()/'code/scrap').as_posix())
+sys.path.append((here()/'code/txt_extraction').as_posix())
+from mock_contraloria import config_default, start_mock, lector_fijo
+from ritmo import Ritmo, sin_ritmo
+
+
+def resumen_tiempos(tiempos_dir) -> dict:
+    """
+    Mean seconds of each phase over the timing logs of the workers
+    """
+    registros = [json.loads(linea) for f in Path(tiempos_dir).glob('tiempos_worker*.jsonl') for linea in open(f)]
+    if not registros:
+        return {}
+    tiempos = pd.DataFrame(registros)
+    fases = [c for c in ['page_load', 'captcha_screenshot', 'ocr', 'submit', 'result_fetch', 'total'] if c in tiempos]
+    return {f"media_{c}": round(tiempos[c].mean(), 3) for c in fases} | {'consultas': len(tiempos),
+            'consultas_fallidas': int((~tiempos['estado']).sum())}
+
+
+def load_scrap(args, ritmo) -> dict:
+    from scrap_pool import run_pool
+
+    cedulas = [f"{i:010d}" for i in range(1, args.cedulas + 1)]
+    with tempfile.TemporaryDirectory() as tiempos_dir:
+        t0 = time.perf_counter()
+        n = 0
+        for cedula, registros in run_pool(cedulas, args.workers, http=not args.browser_fetch,
+                                          tiempos_dir=tiempos_dir, lector=None if args.trocr else lector_fijo,
+                                          perfil={'headless': not args.visible, 'ligero': not args.perfil_completo},
+                                          ritmo=ritmo):
+            n += 1
+            print(f"{n}/{len(cedulas)} {cedula}: {len(registros)} registros")
+        segundos = time.perf_counter() - t0
+        res = {'items': n, 'segundos': round(segundos, 1), 'por_hora': round(3600 * n / segundos)}
+        return res | resumen_tiempos(tiempos_dir)
+
+
+def load_imgs(args, ritmo) -> dict:
+    from img_funcs import make_session, fetch_imgs
+
+    pares = [(f"{i:010d}", str(1000 + i)) for i in range(args.docs)]
+    session = make_session(pool_size=args.workers)
+    t0 = time.perf_counter()
+    sin_datos, errores = 0, 0
+    for cedula, iddoc, imgs in fetch_imgs(pares, session, max_workers=args.workers, ritmo=ritmo):
+        errores += 'error' in imgs
+        sin_datos += isinstance(imgs.get('img0'), str)
+    segundos = time.perf_counter() - t0
+    return {'items': len(pares), 'segundos': round(segundos, 1), 'por_hora': round(3600 * len(pares) / segundos),
+            'sin_datos': sin_datos, 'errores': errores}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Load test against the mock contraloria")
+    parser.add_argument('etapa', choices=['scrap', 'imgs'])
+    parser.add_argument('--workers', type=int, default=4, help="Firefox workers or download threads")
+    parser.add_argument('--cedulas', type=int, default=20)
+    parser.add_argument('--docs', type=int, default=100)
+    parser.add_argument('--puerto', type=int, default=8765)
+    parser.add_argument('--p-error', type=float, default=config_default['p_error'])
+    parser.add_argument('--p-rechazo', type=float, default=config_default['p_rechazo'])
+    parser.add_argument('--escala-latencia', type=float, default=1, help="Multiplies every latency of the mock")
+    parser.add_argument('--trocr', action='store_true', help="Read the captchas with the TrOCR model")
+    parser.add_argument('--browser-fetch', action='store_true', help="Download WFResultados with the browser")
+    parser.add_argument('--visible', action='store_true', help="Show the Firefox windows")
+    parser.add_argument('--perfil-completo', action='store_true', help="Load fonts, styles and all the images")
+    parser.add_argument('--ritmo', type=float, default=None, help="Initial rate of the AIMD controller, none by default")
+    args = parser.parse_args()
+
+    latencia = {k: v * args.escala_latencia for k, v in config_default['latencia'].items()}
+    server = start_mock(args.puerto, p_error=args.p_error, p_rechazo=args.p_rechazo, latencia=latencia,
+                        validar_captcha=args.trocr)
+
+    # Read by `contraloria_url` in this process and in the workers
+    base_url = f"http://127.0.0.1:{args.puerto}"
+    os.environ['CONTRALORIA_URL'] = base_url
+
+    ritmo = sin_ritmo if args.ritmo is None else Ritmo(tasa=args.ritmo)
+    try:
+        res = load_scrap(args, ritmo) if args.etapa == 'scrap' else load_imgs(args, ritmo)
+        res['mock'] = requests.get(f"{base_url}/mock/stats").json()
+        res['ritmo'] = ritmo.estado()
+    finally:
+        server.shutdown()
+
+    res = {'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'), 'etapa': args.etapa} | vars(args) | res
+    print(json.dumps(res, indent=2))
+    with open(here()/"data/temp/load_test.jsonl", 'a') as f:
+        f.write(json.dumps(res) + '\n')
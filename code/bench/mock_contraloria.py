@@ -0,0 +1,223 @@
+"""
+Local stand-in for contraloria.gob.ec to load test the scraper and the image download offline.
+Point the pipeline to it with `CONTRALORIA_URL=http://127.0.0.1:8765`, see `load_test.py`.
+
+Serves:
+  - `/Consultas/DeclaracionesJuradas`: search page with `txtCedula`, `captcha`, `x`, `rdoHistorico_1`,
+    `btnBuscar_in` and `tblBusquedaResultados`, with the same ids as the real page
+  - `/Consultas/Captcha`: captcha image
+  - `/Consultas/Buscar`: checks the captcha, answers with an alert text or the number of pages
+  - `/Consultas/WFResultados.aspx`: JSON pages of registros, `{'data': [[cedula, nombre, ...], ...]}`
+  - `/sistema/WFDeclaracionTemporal.aspx`: declaracion with base64 page images
+  - `/mock/stats`: requests, errors and rejected captchas per route
+
+Every route waits `latencia[ruta]` seconds (+-50%) and fails with a 500 with probability `p_error`.
+Captchas are rejected with probability `p_rechazo`; the text is not checked unless `validar_captcha`.
+Registros are generated from the cedula, so the same cedula always returns the same registros.
+"""
+
+import argparse
+import json
+import random
+import string
+import threading
+import time
+import zlib
+from collections import Counter
+from http.cookies import SimpleCookie
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from bench_funcs import captcha_png, declaracion_html, positions_sinteticas, cargos_base, instituciones_base
+
+config_default = {
+    'latencia': {'pagina': 0.3, 'captcha': 0.05, 'buscar': 0.4, 'resultados': 0.2, 'declaracion': 0.8},
+    'p_error': 0.0,
+    'p_rechazo': 0.1,
+    'validar_captcha': False,
+    'por_pagina': 10,
+}
+
+# Text of the alert of a wrong captcha
+alerta_captcha = 'Codigo de verificacion incorrecto'
+
+pagina_busqueda = """<!DOCTYPE html>
+<html><head><title>Declaraciones Juradas</title></head>
+<body>
+<form onsubmit="return false;">
+  <input type="text" id="txtCedula" />
+  <img id="captcha" src="/Consultas/Captcha" />
+  <input type="text" id="x" />
+  <input type="radio" name="rdoHistorico" id="rdoHistorico_0" checked /> Actual
+  <input type="radio" name="rdoHistorico" id="rdoHistorico_1" /> Historico
+  <button type="button" id="btnBuscar_in" onclick="buscar()">Buscar</button>
+</form>
+<table id="tblBusquedaResultados"><tbody></tbody></table>
+<script>
+function buscar() {
+  var q = 'cedula=' + encodeURIComponent(document.getElementById('txtCedula').value) +
+          '&historico=' + (document.getElementById('rdoHistorico_1').checked ? 1 : 0);
+  var tbody = document.querySelector('#tblBusquedaResultados tbody');
+  fetch('/Consultas/Buscar?' + q + '&x=' + encodeURIComponent(document.getElementById('x').value))
+    .then(function (r) { return r.json(); })
+    .then(function (r) {
+      if (r.alerta) { alert(r.alerta); return; }
+      if (r.paginas == 0) { tbody.textContent = 'Sin resultados'; return; }
+      var paginas = [];
+      for (var p = 0; p < r.paginas; p++) {
+        paginas.push(fetch('/Consultas/WFResultados.aspx?' + q + '&pagina=' + p).then(function (r) { return r.json(); }));
+      }
+      Promise.all(paginas).then(function (ps) {
+        var filas = [];
+        ps.forEach(function (p) { p.data.forEach(function (f) { filas.push('<tr><td>' + f.join('</td><td>') + '</td></tr>'); }); });
+        tbody.innerHTML = filas.join('');
+      });
+    });
+}
+</script>
+</body></html>
+"""
+
+
+def registros_mock(cedula:str, historico:bool) -> list:
+    """
+    Registros of cedula in the historic (before 2015) or current search, as rows of WFResultados
+    """
+    rng = random.Random(f"{cedula}-{historico}")
+    n = rng.choice([0, 0, 1, 2, 3]) if historico else rng.choice([0, 2, 5, 8, 12, 25])
+    anios = range(2003, 2015) if historico else range(2015, 2024)
+    nombre = f"FUNCIONARIO {cedula[-4:]}"
+    return [[cedula, nombre, rng.choice(cargos_base), rng.choice(instituciones_base), 'na',
+             str(rng.choice(anios)), str(rng.randint(1000, 1500000)), 'na'] for _ in range(n)]
+
+
+def lector_fijo(imagenes:list) -> list:
+    """
+    Captcha reader that always returns a valid reading, to load test without the TrOCR model
+    """
+    return [('MOCK1', 1.0) for _ in imagenes]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """
+    Routes of the mock, with the configuration and statistics shared by all the threads
+    """
+    config = config_default
+    stats = Counter()
+    captchas = []
+    declaraciones = []
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def responder(self, cuerpo, tipo:str='application/json', status:int=200, cookie:str=None):
+        if not isinstance(cuerpo, bytes):
+            cuerpo = (json.dumps(cuerpo) if tipo == 'application/json' else cuerpo).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.send_header('Cache-Control', 'no-store')
+        if cookie is not None:
+            self.send_header('Set-Cookie', cookie)
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def contar(self, clave:str):
+        with self.lock:
+            self.stats[clave] += 1
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        rutas = {
+            '/Consultas/DeclaracionesJuradas': ('pagina', self.pagina),
+            '/Consultas/Captcha': ('captcha', self.captcha),
+            '/Consultas/Buscar': ('buscar', self.buscar),
+            '/Consultas/WFResultados.aspx': ('resultados', self.resultados),
+            '/sistema/WFDeclaracionTemporal.aspx': ('declaracion', self.declaracion),
+        }
+        if url.path == '/mock/stats':
+            with self.lock:
+                return self.responder(dict(self.stats))
+        if url.path not in rutas:
+            return self.responder({'error': 'not found'}, status=404)
+
+        ruta, funcion = rutas[url.path]
+        self.contar(ruta)
+        latencia = self.config['latencia'].get(ruta, 0)
+        time.sleep(latencia * random.uniform(0.5, 1.5))
+        if random.random() < self.config['p_error']:
+            self.contar(f"{ruta}_error")
+            return self.responder({'error': 'server error'}, status=500)
+        funcion(q)
+
+    def pagina(self, q):
+        self.responder(pagina_busqueda, 'text/html; charset=utf-8')
+
+    def captcha(self, q):
+        # The cookie tells `buscar` which captcha was shown
+        idx = random.randrange(len(self.captchas))
+        self.responder(self.captchas[idx][1], 'image/png', cookie=f"captcha={idx}; Path=/")
+
+    def buscar(self, q):
+        rechazar = random.random() < self.config['p_rechazo']
+        if self.config['validar_captcha']:
+            cookie = SimpleCookie(self.headers.get('Cookie', ''))
+            idx = int(cookie['captcha'].value) if 'captcha' in cookie else -1
+            rechazar |= not 0 <= idx < len(self.captchas) or self.captchas[idx][0] != q.get('x')
+        if rechazar:
+            self.contar('captcha_rechazado')
+            return self.responder({'alerta': alerta_captcha})
+
+        n = len(registros_mock(q.get('cedula', ''), q.get('historico') == '1'))
+        self.responder({'paginas': -(-n // self.config['por_pagina'])})
+
+    def resultados(self, q):
+        registros = registros_mock(q.get('cedula', ''), q.get('historico') == '1')
+        inicio = int(q.get('pagina', 0)) * self.config['por_pagina']
+        self.responder({'data': registros[inicio:inicio + self.config['por_pagina']]})
+
+    def declaracion(self, q):
+        html = self.declaraciones[zlib.crc32(q.get('td', '').encode()) % len(self.declaraciones)]
+        self.responder(html, 'text/html; charset=utf-8')
+
+
+def start_mock(puerto:int=8765, n_declaraciones:int=8, paginas:int=3, **config) -> ThreadingHTTPServer:
+    """
+    Start the mock in a background thread. `config` overrides the keys of `config_default`.
+    Returns the server, stop it with `server.shutdown()`.
+    """
+    MockHandler.config = {**config_default, **config}
+    MockHandler.stats = Counter()
+
+    # Images are rendered once and served over and over
+    rng = random.Random(0)
+    textos = [''.join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(5)) for _ in range(50)]
+    MockHandler.captchas = [(texto, captcha_png(texto, rng)) for texto in textos]
+    MockHandler.declaraciones = [declaracion_html(paginas, positions_sinteticas(), seed=i)
+                                 for i in range(n_declaraciones)]
+
+    server = ThreadingHTTPServer(('127.0.0.1', puerto), MockHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Local stand-in for contraloria.gob.ec")
+    parser.add_argument('--puerto', type=int, default=8765)
+    parser.add_argument('--p-error', type=float, default=config_default['p_error'])
+    parser.add_argument('--p-rechazo', type=float, default=config_default['p_rechazo'])
+    parser.add_argument('--escala-latencia', type=float, default=1, help="Multiplies every latency")
+    args = parser.parse_args()
+
+    latencia = {k: v * args.escala_latencia for k, v in config_default['latencia'].items()}
+    server = start_mock(args.puerto, p_error=args.p_error, p_rechazo=args.p_rechazo, latencia=latencia)
+    print(f"Mock contraloria at http://127.0.0.1:{args.puerto}, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,175 @@
+"""
+Offline benchmarks of the pipeline stages over synthetic fixtures, no requests to contraloria
+(the download is measured against `mock_contraloria.py` on localhost).
+Run from the root of the project: `python code/bench/run_bench.py [escala]`
+
+Each stage reports the best of 3 runs, items per second and the peak memory allocated by Python.
+The results are printed and appended to `data/temp/bench.jsonl` to compare before and after a change.
+Stages that need the TrOCR weights or tesseract are skipped when they are not available locally.
+"""
+
+import io
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+from pyprojroot import here
+
+sys.path.append((here()/'code').as_posix())
+sys.path.append((here()/'code/scrap').as_posix())
+sys.path.append((here()/'code/txt_extraction').as_posix())
+from bench_funcs import (medir, captcha_pngs, positions_sinteticas, declaracion_img, declaracion_html,
+                         word_boxes_sinteticos, registros_sinteticos, cargos_base, datosimgs_sinteticos)
+from normalizar import limpiar_categorias
+from reglas_cargos import get_fuzzy_scores, aplicar_reglas
+from fechas_funcs import parse_desde_col, group_modes
+from mock_contraloria import start_mock
+
+# Multiplies the size of every fixture
+escala = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+
+
+def n(base:int) -> int:
+    return max(1, int(base * escala))
+
+
+# CAPTCHA ======================================================================
+
+
+def bench_captcha() -> list:
+    os.environ.setdefault('HF_HUB_OFFLINE', '1')
+    try:
+        from scrap_funcs import load_captcha_model, solve_captcha_batch
+        processor, model = load_captcha_model()
+    except (ImportError, OSError) as e:
+        print(f"Skip captcha: {type(e).__name__}, {e}")
+        return []
+
+    imagenes = [Image.open(io.BytesIO(png)).convert('RGB') for png in captcha_pngs(n(16))]
+    res = [medir('captcha_uno_a_uno', lambda: [solve_captcha_batch([img], processor, model) for img in imagenes],
+                 len(imagenes), repeticiones=1)]
+    for batch in (4, 8):
+        lotes = [imagenes[i:i + batch] for i in range(0, len(imagenes), batch)]
+        res.append(medir(f"captcha_batch{batch}", lambda: [solve_captcha_batch(l, processor, model) for l in lotes],
+                         len(imagenes), repeticiones=1))
+    return res
+
+
+# IMAGES ======================================================================
+
+
+def bench_fetch(n_docs:int, max_workers:int=8) -> dict:
+    """
+    Download and decode the first page of n_docs declaraciones with `fetch_imgs` from the mock
+    server without latency, so the time is the HTTP and parsing overhead of the client
+    """
+    from img_funcs import make_session, fetch_imgs
+
+    server = start_mock(0, n_declaraciones=8, paginas=4, latencia={})
+    url_anterior = os.environ.get('CONTRALORIA_URL')
+    os.environ['CONTRALORIA_URL'] = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        session = make_session(pool_size=max_workers)
+        pares = [(f"{i:010d}", str(1000 + i)) for i in range(n_docs)]
+        return medir('fetch_imgs_mock', lambda: [imgs['img0'] for _, _, imgs in fetch_imgs(pares, session, max_workers)],
+                     n_docs)
+    finally:
+        server.shutdown()
+        if url_anterior is None:
+            del os.environ['CONTRALORIA_URL']
+        else:
+            os.environ['CONTRALORIA_URL'] = url_anterior
+
+
+def bench_imgs() -> list:
+    try:
+        from img_funcs import LazyPages, assign_words, img_to_data
+        import pytesseract
+    except ImportError as e:
+        print(f"Skip images: {e.name} not installed")
+        return []
+
+    positions = positions_sinteticas()
+
+    # Decode the pages of a declaracion: only the first page is used by `ocr_doc`
+    htmls = [declaracion_html(4, positions, seed=i) for i in range(n(20))]
+    res = [
+        medir('decode_primera_pagina', lambda: [LazyPages(html)['img0'] for html in htmls], len(htmls)),
+        medir('decode_todas_paginas', lambda: [list(LazyPages(html).values()) for html in htmls], len(htmls)),
+        bench_fetch(n(200)),
+    ]
+
+    # Assign words to fields, independent of tesseract
+    palabras = [word_boxes_sinteticos(400, seed=i) for i in range(n(200))]
+    res.append(medir('assign_words', lambda: [assign_words(t, b, positions) for t, b in palabras], len(palabras)))
+
+    tesseract = shutil.which('tesseract')
+    if tesseract is None:
+        print("Skip OCR: tesseract not found")
+        return res
+    pytesseract.pytesseract.tesseract_cmd = tesseract
+
+    imagenes = [declaracion_img(positions, seed=i) for i in range(n(4))]
+    res.append(medir('ocr_pagina', lambda: [img_to_data(img, positions) for img in imagenes], len(imagenes), 1))
+    res.append(medir('ocr_roi', lambda: [img_to_data(img, positions, roi=True) for img in imagenes], len(imagenes), 1))
+    return res
+
+
+# REGISTROS ======================================================================
+
+
+def bench_registros() -> list:
+    crudos = registros_sinteticos(n(200_000))
+    registros = crudos.copy()
+    juez = {c for c in cargos_base if 'JUEZ' in c or 'PRESIDENTE' in c}
+    fiscal = {c for c in cargos_base if 'FISCAL' in c}
+    columnas = ['cargo', 'institucion']
+
+    # Each run cleans the raw fixture, not the output of the previous run
+    def limpiar():
+        return [limpiar_categorias(crudos[col]) for col in columnas]
+
+    def clasificar():
+        juez_scores = get_fuzzy_scores(registros['cargo'], juez)
+        fiscal_scores = get_fuzzy_scores(registros['cargo'], fiscal)
+        registros['match'] = np.where(juez_scores['score'] >= fiscal_scores['score'], 'juez', 'fiscal')
+        registros['score'] = np.maximum(juez_scores['score'], fiscal_scores['score'])
+
+    registros[columnas] = pd.concat(limpiar(), axis=1)
+    clasificar()
+    return [
+        medir('limpiar_categorias', limpiar, len(registros)),
+        medir('fuzzy_scores', clasificar, len(registros)),
+        medir('aplicar_reglas', lambda: aplicar_reglas(registros), len(registros)),
+    ]
+
+
+# FECHAS ======================================================================
+
+
+def bench_fechas() -> list:
+    datosimgs = datosimgs_sinteticos(n(20_000))
+    return [
+        medir('parse_desde', lambda: parse_desde_col(datosimgs['desde']), len(datosimgs)),
+        medir('group_modes', lambda: group_modes(datosimgs, ['cedula', 'cargo'], 'anio'), len(datosimgs)),
+    ]
+
+
+if __name__ == '__main__':
+
+    resultados = []
+    for bench in [bench_registros, bench_fechas, bench_imgs, bench_captcha]:
+        resultados.extend(bench())
+
+    resultados = pd.DataFrame(resultados)
+    print(resultados.to_string(index=False))
+
+    fecha = time.strftime('%Y-%m-%dT%H:%M:%S')
+    with open(here()/"data/temp/bench.jsonl", 'a') as f:
+        for r in resultados.to_dict('records'):
+            f.write(json.dumps({'fecha': fecha, 'escala': escala, **r}) + '\n')
@@ -0,0 +1,12 @@
+"""
+Address of the contraloria site, shared by the scraper and the image download
+"""
+
+import os
+
+
+def contraloria_url(ruta:str) -> str:
+  """
+  Address of ruta in contraloria, or in the server at `CONTRALORIA_URL` (see `bench/mock_contraloria.py`)
+  """
+  return os.environ.get('CONTRALORIA_URL', 'https://www.contraloria.gob.ec') + ruta
@@ -0,0 +1,170 @@
+"""
+Counters, gauges and latency histograms of the pipeline, and a progress line with the ETA.
+
+Each process records in the module-level `metricas` and writes it to a file: a `.prom` path is
+overwritten in the Prometheus text format (ready for the textfile collector of node_exporter),
+any other path gets a JSON snapshot appended per write. Worker processes write their own file
+with a `worker` label, so the files of a run can be read together.
+"""
+
+import json
+import math
+import os
+import sys
+import threading
+import time
+from datetime import timedelta
+
+# Upper bounds in seconds of the latency histograms
+buckets_default = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+
+
+def clave(nombre:str, etiquetas:dict) -> tuple:
+  return nombre, tuple(sorted((k, str(v)) for k, v in etiquetas.items()))
+
+
+def formato_etiquetas(etiquetas) -> str:
+  if not etiquetas:
+    return ''
+  return '{' + ','.join(f'{k}="{v}"' for k, v in etiquetas) + '}'
+
+
+class Metricas:
+  """
+  Thread-safe registry of counters, gauges and histograms. Series are identified by the name and
+  the keyword labels of the call, plus the labels in `etiquetas` that apply to the whole process.
+  """
+
+  def __init__(self, buckets:tuple=buckets_default):
+    self.buckets = buckets
+    self.etiquetas = {}
+    self.contadores = {}
+    self.medidores = {}
+    self.histogramas = {}
+    self.lock = threading.Lock()
+
+  def contar(self, nombre:str, n:float=1, **etiquetas):
+    k = clave(nombre, etiquetas)
+    with self.lock:
+      self.contadores[k] = self.contadores.get(k, 0) + n
+
+  def medir(self, nombre:str, valor:float, **etiquetas):
+    with self.lock:
+      self.medidores[clave(nombre, etiquetas)] = valor
+
+  def observar(self, nombre:str, valor:float, **etiquetas):
+    k = clave(nombre, etiquetas)
+    with self.lock:
+      h = self.histogramas.setdefault(k, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+      for i, limite in enumerate(self.buckets):
+        if valor <= limite:
+          h['buckets'][i] += 1
+      h['sum'] += valor
+      h['count'] += 1
+
+  def prometheus(self) -> str:
+    """
+    Registry in the Prometheus text format
+    """
+    globales = tuple(sorted((k, str(v)) for k, v in self.etiquetas.items()))
+    lineas, tipos = [], set()
+
+    def tipo(nombre, t):
+      if nombre not in tipos:
+        tipos.add(nombre)
+        lineas.append(f"# TYPE {nombre} {t}")
+
+    with self.lock:
+      for (nombre, etiquetas), valor in sorted(self.contadores.items()):
+        tipo(nombre, 'counter')
+        lineas.append(f"{nombre}{formato_etiquetas(globales + etiquetas)} {valor}")
+      for (nombre, etiquetas), valor in sorted(self.medidores.items()):
+        tipo(nombre, 'gauge')
+        lineas.append(f"{nombre}{formato_etiquetas(globales + etiquetas)} {valor}")
+      for (nombre, etiquetas), h in sorted(self.histogramas.items()):
+        tipo(nombre, 'histogram')
+        for limite, n in zip(self.buckets, h['buckets']):
+          le = '+Inf' if math.isinf(limite) else limite
+          lineas.append(f"{nombre}_bucket{formato_etiquetas(globales + etiquetas + (('le', le),))} {n}")
+        lineas.append(f"{nombre}_sum{formato_etiquetas(globales + etiquetas)} {h['sum']}")
+        lineas.append(f"{nombre}_count{formato_etiquetas(globales + etiquetas)} {h['count']}")
+    return '\n'.join(lineas) + '\n'
+
+  def snapshot(self) -> dict:
+    """
+    Registry as a JSON-friendly dict, series named as `nombre{etiqueta="valor"}`
+    """
+    with self.lock:
+      return {
+        'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'etiquetas': dict(self.etiquetas),
+        'contadores': {n + formato_etiquetas(e): v for (n, e), v in self.contadores.items()},
+        'medidores': {n + formato_etiquetas(e): v for (n, e), v in self.medidores.items()},
+        'histogramas': {n + formato_etiquetas(e): dict(h, buckets=list(h['buckets'])) for (n, e), h in self.histogramas.items()},
+      }
+
+  def escribir(self, path):
+    """
+    Overwrite path in the Prometheus format if it ends in `.prom`, otherwise append a JSON snapshot
+    """
+    path = str(path)
+    if path.endswith('.prom'):
+      tmp = f"{path}.{os.getpid()}.tmp"
+      with open(tmp, 'w') as f:
+        f.write(self.prometheus())
+      os.replace(tmp, path)
+    else:
+      with open(path, 'a') as f:
+        f.write(json.dumps(self.snapshot()) + '\n')
+
+  def escribir_cada(self, path, segundos:float=15):
+    """
+    Write to path every `segundos` from a daemon thread. Call `escribir` at the end for the last values.
+    """
+    def bucle():
+      while True:
+        time.sleep(segundos)
+        self.escribir(path)
+
+    threading.Thread(target=bucle, daemon=True).start()
+
+
+# Registry of this process
+metricas = Metricas()
+
+
+class Progreso:
+  """
+  Progress line with the throughput and the ETA, updated at most every `cada` seconds. On a
+  terminal the line is rewritten in place, otherwise a new line is printed on each update.
+  """
+
+  def __init__(self, total:int, nombre:str='', cada:float=1.0, stream=sys.stderr):
+    self.total, self.nombre, self.cada, self.stream = total, nombre, cada, stream
+    self.hechos = 0
+    self.inicio = time.monotonic()
+    self.ultimo = 0.0
+    self.en_sitio = hasattr(stream, 'isatty') and stream.isatty()
+
+  def linea(self, **extra) -> str:
+    segundos = time.monotonic() - self.inicio
+    tasa = self.hechos / segundos if segundos > 0 else 0.0
+    eta = timedelta(seconds=round((self.total - self.hechos) / tasa)) if tasa > 0 else '?'
+    pct = 100 * self.hechos / self.total if self.total else 100.0
+    partes = [f"{self.nombre} {self.hechos}/{self.total} ({pct:.1f}%)", f"{3600 * tasa:.0f}/h", f"ETA {eta}"]
+    partes += [f"{k} {v}" for k, v in extra.items()]
+    return ' | '.join(partes)
+
+  def avanzar(self, n:int=1, **extra):
+    self.hechos += n
+    ahora = time.monotonic()
+    if ahora - self.ultimo >= self.cada or self.hechos >= self.total:
+      self.ultimo = ahora
+      linea = self.linea(**extra)
+      self.stream.write(f"\r{linea}\033[K" if self.en_sitio else f"{linea}\n")
+      self.stream.flush()
+
+  def cerrar(self):
+    if self.en_sitio:
+      self.stream.write('\n')
+      self.stream.flush()
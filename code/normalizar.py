@@ -0,0 +1,57 @@
+"""
+Normalization of the string columns shared by all the stages. The columns are stored as
+categoricals (dictionary-encoded in parquet) and cleaning runs over the distinct values only.
+"""
+
+import re
+from unidecode import unidecode
+
+import numpy as np
+import pandas as pd
+
+# Columns stored as categoricals across the pipeline
+columnas_cat = ['cedula', 'cargo', 'institucion', 'iddoc', 'year']
+
+
+def limpiar(s):
+  return re.sub(r'\s+', ' ', unidecode(s)).upper().lstrip().rstrip()
+
+
+def categorica(serie:pd.Series) -> pd.Series:
+  """
+  Categorical with the categories sorted, so sorting by the column keeps the order of the strings
+  """
+  if isinstance(serie.dtype, pd.CategoricalDtype):
+    categorias = serie.cat.categories
+    if categorias.is_monotonic_increasing:
+      return serie
+    return serie.cat.reorder_categories(categorias.sort_values())
+  return serie.astype(pd.CategoricalDtype(pd.Index(serie.dropna().unique()).sort_values()))
+
+
+def a_categorias(df:pd.DataFrame, columnas:list=columnas_cat) -> pd.DataFrame:
+  """
+  Convert the columns of df that are in columnas to categoricals
+  """
+  for col in columnas:
+    if col in df.columns:
+      df[col] = categorica(df[col])
+  return df
+
+
+def limpiar_categorias(serie:pd.Series, funcion=limpiar) -> pd.Series:
+  """
+  Apply funcion to the distinct values of serie and map them back to the rows
+  """
+  serie = categorica(serie)
+  if len(serie.cat.categories) == 0:
+    return serie
+
+  # Values that become equal after cleaning share a category
+  limpias = serie.cat.categories.map(funcion)
+  nuevas = limpias.unique().sort_values()
+  recodificar = nuevas.get_indexer(limpias)
+
+  codes = serie.cat.codes.to_numpy()
+  codes = np.where(codes >= 0, recodificar[codes], -1)
+  return pd.Series(pd.Categorical.from_codes(codes, nuevas), index=serie.index, name=serie.name)
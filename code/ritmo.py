@@ -0,0 +1,86 @@
+"""
+Request pacing shared by the scraper and the image download. The rate follows AIMD: it grows
+additively while the responses are fast and successful, and is cut multiplicatively on timeouts,
+HTTP errors or unexpected alerts. The state lives in shared memory, so one controller can be
+passed to the worker processes of `scrap_pool` and used by the threads of `fetch_imgs`.
+"""
+
+import time
+import multiprocessing as mp
+
+# Positions in the shared state
+TASA, PROXIMO, EXITOS, LENTOS, FALLOS, RECORTES, ULTIMO_RECORTE = range(7)
+
+
+class Ritmo:
+  """
+  AIMD rate controller, in requests per second:
+    - `exito(segundos)`: a response faster than `lento` adds `aumento` requests/s per second of successes
+    - `fallo()`: multiplies the rate by `factor`, at most once every `enfriamiento` seconds so a
+      burst of errors from requests that were already in flight counts as a single congestion signal
+  The rate stays within `[minima, maxima]`.
+  """
+
+  def __init__(self, tasa:float=1.0, minima:float=0.05, maxima:float=20.0, aumento:float=0.1,
+               factor:float=0.5, lento:float=10.0, enfriamiento:float=5.0):
+    self.minima, self.maxima = minima, maxima
+    self.aumento, self.factor = aumento, factor
+    self.lento, self.enfriamiento = lento, enfriamiento
+    self.estado_compartido = mp.Array('d', 7)
+    self.estado_compartido[TASA] = tasa
+
+  def esperar(self):
+    """
+    Block until the next request slot
+    """
+    with self.estado_compartido.get_lock():
+      ahora = time.time()
+      turno = max(ahora, self.estado_compartido[PROXIMO])
+      self.estado_compartido[PROXIMO] = turno + 1 / self.estado_compartido[TASA]
+    time.sleep(max(0, turno - ahora))
+
+  def exito(self, segundos:float):
+    e = self.estado_compartido
+    with e.get_lock():
+      if segundos > self.lento:
+        e[LENTOS] += 1
+        return
+      e[EXITOS] += 1
+      e[TASA] = min(self.maxima, e[TASA] + self.aumento / e[TASA])
+
+  def fallo(self):
+    e = self.estado_compartido
+    with e.get_lock():
+      e[FALLOS] += 1
+      ahora = time.time()
+      if ahora - e[ULTIMO_RECORTE] >= self.enfriamiento:
+        e[TASA] = max(self.minima, e[TASA] * self.factor)
+        e[RECORTES] += 1
+        e[ULTIMO_RECORTE] = ahora
+
+  def estado(self) -> dict:
+    e = self.estado_compartido
+    with e.get_lock():
+      return {'tasa': round(e[TASA], 3), 'exitos': int(e[EXITOS]), 'lentos': int(e[LENTOS]),
+              'fallos': int(e[FALLOS]), 'recortes': int(e[RECORTES])}
+
+
+class SinRitmo:
+  """
+  Controller that never waits, the default of the functions that take a `ritmo`
+  """
+
+  def esperar(self):
+    pass
+
+  def exito(self, segundos:float):
+    pass
+
+  def fallo(self):
+    pass
+
+  def estado(self) -> dict:
+    return {}
+
+
+sin_ritmo = SinRitmo()
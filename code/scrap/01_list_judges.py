@@ -4,7 +4,6 @@ The script generates a list of all judges and prosecutors in the sample
 
 import pandas as pd
 from pyprojroot import here
-import numpy as np
 
 # Load base data
 fiscales = pd.read_parquet(r"C:\Users\DanielJaramillo\Documents\3Research\juicios\data\proc\transparencia\datos_fiscales.parquet", columns=['nombre', 'cedula'])
@@ -20,8 +19,3 @@ officials = (officials
 # Store file
 officials.to_parquet(here()/"data/raw/list_officials.parquet", index=False)
 
-
-# Store 7 different files
-for idx, df in enumerate(np.array_split(officials, 7)):
-  df.to_parquet(here()/f"data/temp/officials{idx+1}.parquet", index=False)
-
@@ -1,105 +1,80 @@
 import pandas as pd
-import warnings
 
 from pyprojroot import here
 
-from selenium import webdriver
-from selenium.webdriver.firefox.service import Service
-from selenium.common.exceptions import UnexpectedAlertPresentException
-from webdriver_manager.firefox import GeckoDriverManager
-
-
-from transformers import TrOCRProcessor, VisionEncoderDecoderModel
-
 # Load webscrapper
 import sys
 sys.path.append((here()/'code').as_posix())
-from scrap_funcs import registros_contraloria
-
-# Load Data ===========================================================================
-
-# Define cpus: Each entry is of the form `cpu: (x0, y0)`
-positions = {'1': (0, 0), '2': (0, 200), '3': (200, 0), '4': (200, 200), '5': (0, 0), '6': (0, 100), '7': (400, 0)}
-cpu = "1"
-x0, y0 = [value for key, value in positions.items() if key == cpu][0]
-
-# Load data
-print(f"Begin CPU:{cpu} ---------------------------")
-officials = pd.read_parquet(here()/f"data/temp/officials{cpu}.parquet")
-if 'estado' in officials.columns:
-    faltantes = officials.loc[officials['estado'].isna()]
-else:
-    faltantes = officials.copy()
-
-
-# Set-up Model and Driver ============================================================================
-
-# Load models to detect captcha
-processor = TrOCRProcessor.from_pretrained('microsoft/trocr-large-printed')
-model = VisionEncoderDecoderModel.from_pretrained('microsoft/trocr-large-printed')
-
-# Start Webdriver
-s = (Service(GeckoDriverManager().install()))
-options = webdriver.FirefoxOptions()
-driver = webdriver.Firefox(service=s, options=options)
-driver.set_window_rect(x=x0, y=y0)
-
-
-def get_data(cedula, antes15, driver, processor, model):
-    try:
-        return registros_contraloria(cedula, antes15, driver, processor, model)
-    except UnexpectedAlertPresentException:
-        print("Error de alerta no presente!")
-        return {'estado': False}
-
-# Call function =======================================================================================
-
-for row in faltantes.iterrows():
-    cedula = row[1]['cedula']
-    print(f"Working on {cedula} ---------------------------------------------------------")
-
-    # Look for cedula, antes de 2015
-    r = get_data(cedula, True, driver, processor, model)
-    while not r['estado']:
-        print(f"Try again with {cedula}")
-        r = get_data(cedula, True, driver, processor, model)
-
-    before15 = pd.DataFrame(
-        r['res'],
-        columns=['cedula', 'nombre', 'cargo', 'institucion', 'na1', 'year', 'iddoc', 'na2']
-    )
-
-    # Look for cedula after 2015
-    r = get_data(cedula, False, driver, processor, model)
-    while not r['estado']:
-        print(f"Try again with {cedula}")
-        r = get_data(cedula, False, driver, processor, model)
-    after15 = pd.DataFrame(
-        r['res'],
-        columns=['cedula', 'nombre', 'cargo', 'institucion', 'na1', 'year', 'iddoc', 'na2']
-    )
-
-    # Store results of registros
-    try:
-        registros = pd.read_parquet(here() / f"data/temp/registro{cpu}.parquet")
-    except FileNotFoundError:
-        registros = pd.DataFrame()
-
-    registros = pd.concat([registros, pd.concat([before15, after15])], ignore_index=True)
-    with warnings.catch_warnings():
-        warnings.filterwarnings('ignore')
-        registros.to_parquet(here() / f"data/temp/registro{cpu}.parquet", index=False)
-    print("Saved registros data")
-
-    # Store results of estado
-    officials.loc[officials.index == row[0], 'estado'] = 1
-    with warnings.catch_warnings():
-        warnings.filterwarnings('ignore')
-        officials.to_parquet(here()/f"data/temp/officials{cpu}.parquet", index=False)
-    print("Saved estado data")
-
-
-# Close driver
-print(f"Done with CPU {cpu}!!!")
-driver.close()
+from scrap_pool import run_pool, historico_por_inicio, consultar_siempre
+from ritmo import Ritmo
+from metricas import metricas, Progreso
+from registros_log import open_log, append_registros, cedulas_hechas, cedulas_vencidas, compact_log
+
+# Number of Firefox workers: `python 02_scrap_contraloria.py 7`
+n_workers = int(sys.argv[1]) if len(sys.argv) > 1 else 7
+
+# Skip the search before 2015 of officials that started after 2015 (needs `date_inicio_officials.parquet`)
+saltar_historico = False
+
+# Delta mode: `python 02_scrap_contraloria.py 7 delta` also queries again the search after 2015 of
+# the cedulas last queried more than `dias_vigencia` days ago, keeping only declaraciones not seen before
+delta = len(sys.argv) > 2 and sys.argv[2] == 'delta'
+dias_vigencia = 7
+
+# Pace of the queries of all the workers, in queries per second (see `ritmo.Ritmo`)
+ritmo_inicial, ritmo_maximo = 0.5, 5
+
+# Metrics of this script and of each worker, `.prom` (Prometheus text) or `.jsonl` files
+metricas_dir = here()/"data/temp/metricas"
+formato_metricas = 'prom'
+
+
+if __name__ == '__main__':
+
+    # Load Data ===========================================================================
+    officials = pd.read_parquet(here()/"data/raw/list_officials.parquet")
+    log = open_log(here()/"data/temp/registros_log.sqlite")
+
+    # Skip cedulas already in the log
+    hechas = cedulas_hechas(log)
+    faltantes = officials.loc[~officials['cedula'].isin(hechas), 'cedula'].tolist()
+
+    # Stale cedulas in delta mode
+    vencidas = cedulas_vencidas(log, dias_vigencia) if delta else set()
+    refrescar = officials.loc[officials['cedula'].isin(vencidas), 'cedula'].tolist()
+    print(f"Begin with {n_workers} workers, {len(faltantes)} cedulas left, {len(refrescar)} to refresh ------------")
+
+    # Call function =======================================================================================
+
+    politica = consultar_siempre
+    if saltar_historico:
+        politica = historico_por_inicio(here()/"data/date_inicio_officials.parquet")
+
+    # The search before 2015 does not change, refreshed cedulas only query the current one
+    def consultar_historico(cedula):
+        return cedula not in vencidas and politica(cedula)
+
+    metricas_dir.mkdir(parents=True, exist_ok=True)
+    metricas_path = metricas_dir/f"scrap.{formato_metricas}"
+    metricas.escribir_cada(metricas_path)
+
+    ritmo = Ritmo(tasa=ritmo_inicial, maxima=ritmo_maximo, lento=30)
+    progreso = Progreso(len(faltantes) + len(refrescar), 'cedulas')
+    for cedula, nuevos in run_pool(faltantes + refrescar, n_workers, tiempos_dir=here()/"data/temp",
+                                   consultar_historico=consultar_historico, ritmo=ritmo,
+                                   metricas_path=f"{metricas_dir}/scrap_worker{{worker_id}}.{formato_metricas}"):
+        nuevos = append_registros(log, cedula, nuevos, solo_nuevos=cedula in hechas)
+
+        metricas.contar('cedulas_total', modo='delta' if cedula in hechas else 'nueva')
+        metricas.contar('registros_total', len(nuevos))
+        for k, v in ritmo.estado().items():
+            metricas.medir(f"ritmo_{k}", v)
+        progreso.avanzar(ultima=cedula, ritmo=f"{ritmo.estado()['tasa']}/s")
+
+    progreso.cerrar()
+    metricas.escribir(metricas_path)
 
+    # Store file
+    compact_log(log, here()/"data/wscrap/registros_raw.parquet")
+    log.close()
+    print("Done with all cedulas!!!")
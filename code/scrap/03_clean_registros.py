@@ -1,36 +1,23 @@
 
-import re
 import numpy as np
-from unidecode import unidecode
-from rapidfuzz import process, fuzz
 
 import pandas as pd
 from pyprojroot import here
 
+import sys
+sys.path.append((here()/'code').as_posix())
+from normalizar import limpiar, a_categorias, limpiar_categorias
+from reglas_cargos import get_fuzzy_scores, aplicar_reglas
+
 # Load Necesary data ==============================================================
-registros = pd.read_parquet(here()/"data/wscrap/registros_raw.parquet")
+registros = a_categorias(pd.read_parquet(here()/"data/wscrap/registros_raw.parquet"))
 clasificacion = pd.read_parquet(here()/"data/raw/clasif_cargos.parquet")
 
-# Useful functions ================================================================
-
-
-def limpiar(s):
-  return re.sub(r'\s+', ' ', unidecode(s)).upper().lstrip().rstrip()
-
-
-def get_fuzzy_score(word, choices):
-  r = process.extract(word, choices, scorer=fuzz.token_sort_ratio, limit=1)
-  if r:
-    return r[0][:-1]
-  else:
-    return ('No match', 0)
-
-
 # Clean Data ===============================================================
 
 # Remove unnecesary no data
 registros['con_data'] = 1*(registros['iddoc'] != 'No data')
-registros['any_data'] = registros.groupby('cedula')['con_data'].transform(max)
+registros['any_data'] = registros.groupby('cedula', observed=True)['con_data'].transform('max')
 
 registros = (registros
              .loc[~((registros['any_data'] == 1) & (registros['con_data'] == 0))]
@@ -40,8 +27,9 @@ registros = (registros
              .reset_index(drop=True)
              )
 
-# Clean cargos
-registros[['cargo', 'institucion']] = registros[['cargo', 'institucion']].applymap(limpiar)
+# Clean cargos, only the distinct values are cleaned
+for col in ['cargo', 'institucion']:
+  registros[col] = limpiar_categorias(registros[col])
 registros.to_parquet(here()/"data/registros_all.parquet", index=False)
 
 # Keep only records with documents
@@ -56,14 +44,8 @@ fiscal = set(clasificacion.query("cargo_dummy=='fiscal'")['cargo'])
 fiscal = fiscal.union({'FISCAL DISTRITO', 'FISCAL DEL JUZGADO II SUBTENIENTE'})
 
 # Get scores
-fjuez = lambda x: get_fuzzy_score(x, juez)
-ffiscal = lambda x: get_fuzzy_score(x, fiscal)
-registros['match_juez'] = registros['cargo'].map(fjuez)
-registros['match_fiscal'] = registros['cargo'].map(ffiscal)
-
-# Split into columns
-registros[['match_juez', 'score_juez']] = registros['match_juez'].apply(pd.Series)
-registros[['match_fiscal', 'score_fiscal']] = registros['match_fiscal'].apply(pd.Series)
+registros[['match_juez', 'score_juez']] = get_fuzzy_scores(registros['cargo'], juez)
+registros[['match_fiscal', 'score_fiscal']] = get_fuzzy_scores(registros['cargo'], fiscal)
 
 # Keep record with highest value
 registros['match'] = np.where(
@@ -86,96 +68,19 @@ registros['score'] = np.where(
   )
 )
 
-# Save temp data
-#registros.to_parquet(here()/"data/temp/reg_categorias.parquet", index=False)
-registros = pd.read_parquet(here()/"data/temp/reg_categorias.parquet")
-
-# Cahnge to 100 if starts with juez -----------------------------------------------
-strpatron = r"^magi|^jue|^conjue|^con jue|^ex jue|^juaza|^jez\b|^juz\b|^juuz\b|^jeuza\b|^jeueza\b|^jeuz\b|^juaz\b"
-patron = re.compile(strpatron, flags=re.IGNORECASE)
-registros.loc[registros['cargo'].str.contains(patron, regex=True), 'match'] = 'juez'
-registros.loc[registros['cargo'].str.contains(patron, regex=True), 'score'] = 100
-
-# Juez en cualquier palabra, menos secretario
-patron = re.compile('juez', flags=re.IGNORECASE)
-registros.loc[registros['cargo'].str.contains(patron) & (registros['score']<100), 'match'] = 'juez'
-registros.loc[registros['cargo'].str.contains(patron) & (registros['score']<100), 'score'] = 100
-
-patron = re.compile(r'^secre', flags=re.IGNORECASE)
-registros.loc[registros['cargo'].str.contains(patron), 'match'] = 'otro'
-registros.loc[registros['cargo'].str.contains(patron), 'score'] = np.nan
-
-# Algunos tienen juez en institucion
-patron = re.compile(r'^jue|^conjue|^con jue', flags=re.IGNORECASE)
-registros.loc[registros['institucion'].str.contains(patron, regex=True), 'match'] = 'juez'
-registros.loc[registros['institucion'].str.contains(patron, regex=True), 'score'] = 100
-
-# Presidente de tribunales
-indices = (
-    registros['cargo'].str.contains(r'corte|tribunal|tribyunal|sala', regex=True, flags=re.IGNORECASE) &
-    registros['cargo'].str.contains(r'^presi|^presdiente|\bminis', regex=True, flags=re.IGNORECASE)
+# Reclassify with the rules in `reglas_cargos` ----------------------------------
+registros = aplicar_reglas(registros)
+(
+  registros[['cedula', 'iddoc', 'cargo', 'institucion', 'match', 'score', 'reglas']]
+  .to_parquet(here()/"data/temp/reglas_audit.parquet", index=False)
 )
-registros.loc[indices, 'match'] = 'juez'
-registros.loc[indices, 'score'] = 100
-
-
-# 100 for fiscales ----------------------------------------------------------------
-patron = re.compile(r'^fiscal|^ag|^ganete|agente fiscal|^egente|^ex- fiscal|^ex-ministro fiscal',
-                    flags=re.IGNORECASE)
-registros.loc[registros['cargo'].str.contains(patron, regex=True), 'match'] = 'fiscal'
-registros.loc[registros['cargo'].str.contains(patron, regex=True), 'score'] = 100
-
-# Define fiscalia
-registros.loc[registros['institucion'].str.contains('MINISTERIO')
-              & registros['institucion'].str.contains('FISCAL'), 'fiscalia'] = 1
-registros.loc[registros['institucion'].str.contains('MINISTERIO')
-              & registros['institucion'].str.contains('PUBLICO'), 'fiscalia'] = 1
-
-patron = re.compile(r'^fi', flags=re.IGNORECASE)
-registros.loc[registros['institucion'].str.contains(patron, regex=True), 'fiscalia'] = 1
-
-patron = re.compile(r'f(.|)g(.|)e', flags=re.IGNORECASE)
-registros.loc[registros['institucion'].str.contains(patron, regex=True), 'fiscalia'] = 1
-
-patron = re.compile(r'judicial|tribunal', flags=re.IGNORECASE)
-registros.loc[registros['institucion'].str.contains(patron, regex=True), 'fiscalia'] = 0
-
-# Add ministro fiscal to fiscales
-patron = re.compile(r'^minist', flags=re.IGNORECASE)
-registros.loc[registros['cargo'].str.contains(patron, regex=True) & (registros['fiscalia'] == 1), 'match'] = 'fiscal'
-registros.loc[registros['cargo'].str.contains(patron, regex=True) & (registros['fiscalia'] == 1), 'score'] = 100
-
-
-# Move to others the ones we are not sure -------------------------------------------
-
-# Literal values
-registros.loc[registros['cargo'] == 'AGOGADO', 'match'] = 'otro'
-registros.loc[registros['cargo'] == 'AGOGADO', 'score'] = np.nan
-
-# Change to missing values with no cargo
-registros.loc[registros['cargo'] == '', 'match'] = np.nan
-
-# Puntaje general menor a 55
-registros.loc[registros['score'] < 55, 'match'] = 'otro'
-registros.loc[registros['score'] < 55, 'score'] = np.nan
-
-# Botar dentro de fiscalia
-registros.loc[(registros['score'] < 90) & (registros['fiscalia'] == 1), 'match'] = 'otro'
-registros.loc[(registros['score'] < 90) & (registros['fiscalia'] == 1), 'score'] = np.nan
-
-# Botar puestos clasificados como fiscales que no son
-registros.loc[(registros['score'] < 90) & (registros['match'] == 'fiscal'), 'match'] = 'otro'
-registros.loc[(registros['score'] < 90) & (registros['match'] == 'fiscal'), 'score'] = np.nan
-
-# Botar puestos clasificados como jueces que no son
-registros.loc[(registros['score'] < 95) & (registros['match'] == 'juez'), 'match'] = 'otro'
-registros.loc[(registros['score'] < 95) & (registros['match'] == 'juez'), 'score'] = np.nan
 
 
 # Save data =======================================================
 (
   registros[['cedula', 'iddoc', 'year', 'match']]
   .rename(columns={'match': 'cargo'})
+  .pipe(a_categorias)
   .to_parquet(here()/"data/wscrap/registros_juez_fiscal.parquet", index=False)
 )
 
@@ -0,0 +1,61 @@
+"""
+Firefox extension of the lean scraping profile: cancels the requests of styles, fonts, media and
+every image but the captcha. The xpi is written to a temporary folder once per process.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+
+manifest_bloqueo = {
+    'manifest_version': 2,
+    'name': 'bloquear-recursos',
+    'version': '1.0',
+    'browser_specific_settings': {'gecko': {'id': 'bloquear-recursos@scrap'}},
+    'permissions': ['webRequest', 'webRequestBlocking', '<all_urls>'],
+    'background': {'scripts': ['background.js']},
+}
+
+# JavaScript has no inline flags such as `(?i)`, the match is made case-insensitive with the 'i' flag
+background_bloqueo = """
+const permitir = new RegExp(%s, 'i');
+browser.webRequest.onBeforeRequest.addListener(
+  d => ({cancel: !(d.type === 'image' && permitir.test(d.url))}),
+  {urls: ['<all_urls>'], types: ['image', 'imageset', 'stylesheet', 'font', 'media']},
+  ['blocking']
+);
+"""
+
+# Xpi of the blocking extension by permitir, written once per process
+extensiones = {}
+
+
+def background_js(permitir:str) -> str:
+    """
+    Background script that lets through the images whose url matches the JavaScript regex permitir
+    """
+    return background_bloqueo % json.dumps(permitir)
+
+
+def extension_bloqueo(permitir:str) -> str:
+    """
+    Path of the xpi of the blocking extension, letting through the images whose url matches permitir
+    """
+    if permitir not in extensiones:
+        path = os.path.join(tempfile.mkdtemp(prefix='scrap_'), 'bloquear.xpi')
+        with zipfile.ZipFile(path, 'w') as xpi:
+            xpi.writestr('manifest.json', json.dumps(manifest_bloqueo))
+            xpi.writestr('background.js', background_js(permitir))
+        extensiones[permitir] = path
+    return extensiones[permitir]
+
+
+def borrar_extensiones():
+    """
+    Remove the temporary folders of the xpi written by `extension_bloqueo`
+    """
+    while extensiones:
+        _, path = extensiones.popitem()
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
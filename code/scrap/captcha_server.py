@@ -0,0 +1,85 @@
+"""
+Captcha solver shared by all the scrap workers. The model is loaded once and the captchas that
+arrive within a short window are read together with a single call to `generate`.
+"""
+
+import queue
+import time
+import traceback
+
+from scrap_funcs import load_captcha_model, solve_captcha_batch, png_to_img
+
+
+def captcha_server(solicitudes, respuestas:dict, max_batch:int=8, ventana:float=0.05, lector=None):
+    """
+    Read `(worker_id, png bytes)` from `solicitudes` and put `(text, confidence)` in `respuestas[worker_id]`.
+    Waits at most `ventana` seconds after the first request to fill a batch. Stops with `None`.
+    `lector` maps a list of images to their readings; by default the TrOCR model is loaded.
+    If a batch fails its images are read one by one, and an image that still fails is answered
+    with `("", 0.0)` so the worker refreshes the captcha instead of waiting forever.
+    """
+    if lector is None:
+        processor, model = load_captcha_model()
+        lector = lambda imagenes: solve_captcha_batch(imagenes, processor, model)
+
+    activo = True
+    while activo:
+        msg = solicitudes.get()
+        if msg is None:
+            break
+
+        # Collect more captchas during the window
+        batch = [msg]
+        limite = time.monotonic() + ventana
+        while len(batch) < max_batch:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                msg = solicitudes.get(timeout=restante)
+            except queue.Empty:
+                break
+            if msg is None:
+                activo = False
+                break
+            batch.append(msg)
+
+        lecturas = leer_batch(lector, [png for _, png in batch])
+        for (worker_id, _), lectura in zip(batch, lecturas):
+            respuestas[worker_id].put(lectura)
+
+
+def leer_batch(lector, pngs:list) -> list:
+    """
+    Readings of the png bytes in pngs, `("", 0.0)` for the images that cannot be read
+    """
+    try:
+        return list(lector([png_to_img(png) for png in pngs]))
+    except Exception:
+        traceback.print_exc()
+        if len(pngs) == 1:
+            return [("", 0.0)]
+
+    lecturas = []
+    for png in pngs:
+        try:
+            lecturas += list(lector([png_to_img(png)]))
+        except Exception:
+            traceback.print_exc()
+            lecturas.append(("", 0.0))
+    return lecturas
+
+
+def remote_solver(worker_id:int, solicitudes, respuesta, timeout:float=120):
+    """
+    Solver that sends the png bytes of the captcha to `captcha_server` and waits for the reading.
+    Raises `RuntimeError` if the server does not answer within `timeout` seconds.
+    """
+    def solver(image_binary:bytes) -> tuple:
+        solicitudes.put((worker_id, image_binary))
+        try:
+            return respuesta.get(timeout=timeout)
+        except queue.Empty:
+            raise RuntimeError(f"No answer from the captcha server in {timeout} s") from None
+
+    return solver
@@ -0,0 +1,89 @@
+"""
+Append-only log of scrapped registros. Every cedula is written in a single SQLite transaction,
+so a crash never leaves a half written cedula and resuming only needs the list of cedulas in the log.
+
+The log is also the freshness manifest of the delta mode: `cedulas` keeps when each cedula was
+last queried and `iddocs` the declaraciones it returned, so a refresh only queries stale cedulas
+and only adds the registros of declaraciones not seen before.
+"""
+
+import sqlite3
+
+import pandas as pd
+
+from normalizar import a_categorias
+
+# Columns returned by WFResultados
+columnas = ['cedula', 'nombre', 'cargo', 'institucion', 'na1', 'year', 'iddoc', 'na2']
+
+
+def open_log(path) -> sqlite3.Connection:
+    """
+    Open (or create) the log at path
+    """
+    con = sqlite3.connect(path)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute(f"CREATE TABLE IF NOT EXISTS registros ({', '.join(f'{c} TEXT' for c in columnas)})")
+    con.execute("CREATE TABLE IF NOT EXISTS cedulas (cedula TEXT PRIMARY KEY, fecha TEXT DEFAULT CURRENT_TIMESTAMP)")
+    con.execute("CREATE TABLE IF NOT EXISTS iddocs (cedula TEXT, iddoc TEXT, fecha TEXT DEFAULT CURRENT_TIMESTAMP, "
+                "PRIMARY KEY (cedula, iddoc))")
+
+    # Logs written before the manifest existed
+    if con.execute("SELECT count(*) FROM iddocs").fetchone()[0] == 0:
+        con.execute("INSERT OR IGNORE INTO iddocs (cedula, iddoc) "
+                    "SELECT cedula, iddoc FROM registros WHERE iddoc NOT IN ('No data', '0')")
+    con.commit()
+    return con
+
+
+def iddocs_vistos(con:sqlite3.Connection, cedula:str) -> set:
+    return {row[0] for row in con.execute("SELECT iddoc FROM iddocs WHERE cedula = ?", (cedula,))}
+
+
+def append_registros(con:sqlite3.Connection, cedula:str, registros:pd.DataFrame, solo_nuevos:bool=False):
+    """
+    Add the registros of cedula and mark it as done now. With `solo_nuevos` only the registros of
+    declaraciones not seen before are added, for a cedula that is already in the log.
+    """
+    registros = registros[columnas].astype(str)
+    if solo_nuevos:
+        registros = registros.loc[~registros['iddoc'].isin(iddocs_vistos(con, cedula) | {'No data', '0'})]
+    iddocs = [(cedula, iddoc) for iddoc in registros['iddoc'].unique() if iddoc not in ('No data', '0')]
+
+    with con:
+        con.executemany(f"INSERT INTO registros VALUES ({', '.join('?' for _ in columnas)})",
+                        registros.itertuples(index=False, name=None))
+        con.executemany("INSERT OR IGNORE INTO iddocs (cedula, iddoc) VALUES (?, ?)", iddocs)
+        con.execute("INSERT OR REPLACE INTO cedulas (cedula) VALUES (?)", (cedula,))
+    return registros
+
+
+def cedulas_hechas(con:sqlite3.Connection) -> set:
+    return {row[0] for row in con.execute("SELECT cedula FROM cedulas")}
+
+
+def cedulas_vencidas(con:sqlite3.Connection, dias:float) -> set:
+    """
+    Cedulas last queried more than `dias` days ago
+    """
+    query = "SELECT cedula FROM cedulas WHERE fecha < datetime('now', ?)"
+    return {row[0] for row in con.execute(query, (f"-{dias} days",))}
+
+
+def manifiesto(con:sqlite3.Connection) -> pd.DataFrame:
+    """
+    Last query and number of declaraciones seen of each cedula
+    """
+    return pd.read_sql_query(
+        "SELECT c.cedula, c.fecha, count(i.iddoc) AS iddocs, max(i.fecha) AS ultimo_iddoc "
+        "FROM cedulas c LEFT JOIN iddocs i ON c.cedula = i.cedula GROUP BY c.cedula", con
+    )
+
+
+def compact_log(con:sqlite3.Connection, path):
+    """
+    Write all the registros in the log to a parquet file, with dictionary-encoded strings
+    """
+    registros = a_categorias(pd.read_sql_query(f"SELECT {', '.join(columnas)} FROM registros", con))
+    registros.to_parquet(path, index=False)
+    return registros
@@ -0,0 +1,144 @@
+"""
+Classification of the cargos into juez, fiscal or otro: fuzzy match against the list of cargos
+and rules to reclassify the match.
+
+Each rule is applied in order over the registros. A rule fires on the rows where every pattern
+in `patrones` matches its column and the optional `cuando` expression (evaluated with
+`DataFrame.eval` over the current values) is true. It then sets the columns in `asignar`.
+Patterns are `(columna, regex)` or `(columna, regex, flags)`; flags default to IGNORECASE.
+"""
+
+import re
+import numpy as np
+import pandas as pd
+from rapidfuzz import process, fuzz, utils
+
+
+def get_fuzzy_scores(words:pd.Series, choices:set) -> pd.DataFrame:
+  """
+  Best match in choices for each word and its score. Each distinct word is scored once against
+  all the choices with `process.cdist`, using every core, and mapped back to the rows.
+  Missing words get `'No match'` and 0, as when there are no choices.
+  """
+  codes, uniques = pd.factorize(words)
+  choices = sorted(choices)
+  if not choices:
+    return pd.DataFrame({'match': 'No match', 'score': 0.0}, index=words.index)
+
+  scores = process.cdist(list(uniques), choices, scorer=fuzz.token_sort_ratio, processor=utils.default_process,
+                         workers=-1)
+  best = scores.argmax(axis=1)
+
+  # Missing words have code -1, which picks the last entry
+  match = np.array(list(np.asarray(choices, dtype=object)[best]) + ['No match'], dtype=object)[codes]
+  score = np.append(scores[np.arange(len(uniques)), best].astype(float), 0.0)[codes]
+  return pd.DataFrame({'match': match, 'score': score}, index=words.index)
+
+
+reglas = [
+  # Cambiar a 100 si empieza con juez
+  dict(nombre='juez_inicio',
+       patrones=[('cargo', r"^magi|^jue|^conjue|^con jue|^ex jue|^juaza|^jez\b|^juz\b|^juuz\b|^jeuza\b|^jeueza\b|^jeuz\b|^juaz\b")],
+       asignar={'match': 'juez', 'score': 100}),
+
+  # Juez en cualquier palabra, menos secretario
+  dict(nombre='juez_palabra', patrones=[('cargo', 'juez')], cuando="score < 100",
+       asignar={'match': 'juez', 'score': 100}),
+  dict(nombre='secretario', patrones=[('cargo', r'^secre')],
+       asignar={'match': 'otro', 'score': np.nan}),
+
+  # Algunos tienen juez en institucion
+  dict(nombre='juez_institucion', patrones=[('institucion', r'^jue|^conjue|^con jue')],
+       asignar={'match': 'juez', 'score': 100}),
+
+  # Presidente de tribunales
+  dict(nombre='presidente_tribunal',
+       patrones=[('cargo', r'corte|tribunal|tribyunal|sala'), ('cargo', r'^presi|^presdiente|\bminis')],
+       asignar={'match': 'juez', 'score': 100}),
+
+  # 100 for fiscales
+  dict(nombre='fiscal_inicio',
+       patrones=[('cargo', r'^fiscal|^ag|^ganete|agente fiscal|^egente|^ex- fiscal|^ex-ministro fiscal')],
+       asignar={'match': 'fiscal', 'score': 100}),
+
+  # Define fiscalia
+  dict(nombre='ministerio_fiscal', patrones=[('institucion', 'MINISTERIO', 0), ('institucion', 'FISCAL', 0)],
+       asignar={'fiscalia': 1}),
+  dict(nombre='ministerio_publico', patrones=[('institucion', 'MINISTERIO', 0), ('institucion', 'PUBLICO', 0)],
+       asignar={'fiscalia': 1}),
+  dict(nombre='fiscalia_inicio', patrones=[('institucion', r'^fi')], asignar={'fiscalia': 1}),
+  dict(nombre='fiscalia_fge', patrones=[('institucion', r'f(.|)g(.|)e')], asignar={'fiscalia': 1}),
+  dict(nombre='judicatura', patrones=[('institucion', r'judicial|tribunal')], asignar={'fiscalia': 0}),
+
+  # Add ministro fiscal to fiscales
+  dict(nombre='ministro_fiscal', patrones=[('cargo', r'^minist')], cuando="fiscalia == 1",
+       asignar={'match': 'fiscal', 'score': 100}),
+
+  # Literal values
+  dict(nombre='agogado', patrones=[('cargo', r'^AGOGADO$', 0)], asignar={'match': 'otro', 'score': np.nan}),
+
+  # Change to missing values with no cargo
+  dict(nombre='sin_cargo', patrones=[('cargo', r'^$', 0)], asignar={'match': np.nan}),
+
+  # Puntaje general menor a 55
+  dict(nombre='score_bajo', cuando="score < 55", asignar={'match': 'otro', 'score': np.nan}),
+
+  # Botar dentro de fiscalia
+  dict(nombre='fiscalia_score_bajo', cuando="score < 90 and fiscalia == 1", asignar={'match': 'otro', 'score': np.nan}),
+
+  # Botar puestos clasificados como fiscales que no son
+  dict(nombre='fiscal_score_bajo', cuando="score < 90 and match == 'fiscal'", asignar={'match': 'otro', 'score': np.nan}),
+
+  # Botar puestos clasificados como jueces que no son
+  dict(nombre='juez_score_bajo', cuando="score < 95 and match == 'juez'", asignar={'match': 'otro', 'score': np.nan}),
+]
+
+
+class PatronCache:
+  """
+  Evaluate each regex once per distinct value of a column and map the result back to the rows
+  """
+
+  def __init__(self, df:pd.DataFrame):
+    self.df = df
+    self.codes = {}
+    self.resultados = {}
+
+  def mask(self, columna:str, patron:str, flags:int=re.IGNORECASE) -> np.ndarray:
+    if columna not in self.codes:
+      self.codes[columna] = pd.factorize(self.df[columna])
+    codes, uniques = self.codes[columna]
+
+    key = (columna, patron, flags)
+    if key not in self.resultados:
+      rx = re.compile(patron, flags=flags)
+      # Last position is for missing values (code -1)
+      self.resultados[key] = np.array([rx.search(u) is not None for u in uniques] + [False], dtype=bool)
+    return self.resultados[key][codes]
+
+
+def aplicar_reglas(df:pd.DataFrame, reglas:list=reglas) -> pd.DataFrame:
+  """
+  Apply the rules in order and add a `reglas` column with the names of the rules that fired on each row
+  """
+  df = df.copy()
+  patrones = PatronCache(df)
+  disparadas = [[] for _ in range(len(df))]
+
+  for regla in reglas:
+    mask = np.ones(len(df), dtype=bool)
+    for patron in regla.get('patrones', []):
+      mask &= patrones.mask(*patron)
+    if 'cuando' in regla:
+      mask &= df.eval(regla['cuando'], engine='python').fillna(False).to_numpy(dtype=bool)
+
+    for columna, valor in regla['asignar'].items():
+      if columna not in df.columns:
+        df[columna] = np.nan
+      df.loc[mask, columna] = valor
+
+    for idx in np.flatnonzero(mask):
+      disparadas[idx].append(regla['nombre'])
+
+  df['reglas'] = [';'.join(r) for r in disparadas]
+  return df
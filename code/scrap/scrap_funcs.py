@@ -1,33 +1,139 @@
 
 import json
+import re
 
 from PIL import Image
 import io
 import time
+import logging
+import warnings
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
+import requests
+from requests.adapters import HTTPAdapter
+
+import pandas as pd
+from selenium import webdriver
+from selenium.webdriver.firefox.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import NoAlertPresentException
+from selenium.common.exceptions import NoAlertPresentException, UnexpectedAlertPresentException, TimeoutException
+from webdriver_manager.firefox import GeckoDriverManager
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from ritmo import sin_ritmo
+from metricas import metricas
+from contraloria import contraloria_url
+from registros_log import columnas
+from bloqueo import extension_bloqueo
+
+# Timing of each query, one JSON record per line
+tiempos_log = logging.getLogger('scrap_funcs.tiempos')
+
+# Expected shape of the captcha text
+captcha_patron = re.compile(r'[0-9A-Za-z]{4,6}')
 
 
 # Relevant Functions
-def solve_captcha(imagen, processor, model):
-    pixel_values = processor(images=imagen, return_tensors='pt').pixel_values
-    generated_ids = model.generate(pixel_values, max_new_tokens=6)
-    return processor.batch_decode(generated_ids, skip_special_tokens=True)[0].replace('&', '8')
+def load_captcha_model():
+    """
+    Return processor and model used to read the captcha. transformers is imported here so the
+    Firefox workers, which only send the captchas to `captcha_server`, do not load it.
+    """
+    from transformers import TrOCRProcessor, VisionEncoderDecoderModel
+
+    processor = TrOCRProcessor.from_pretrained('microsoft/trocr-large-printed')
+    model = VisionEncoderDecoderModel.from_pretrained('microsoft/trocr-large-printed')
+    return processor, model
+
+
+def solve_captcha_batch(imagenes:list, processor, model) -> list:
+    """
+    Read a list of captcha images with a single call to `generate`. Returns `(text, confidence)`
+    for each image, where confidence is the probability of the generated sequence.
+    """
+    pixel_values = processor(images=imagenes, return_tensors='pt').pixel_values
+    out = model.generate(pixel_values, max_new_tokens=6, output_scores=True, return_dict_in_generate=True)
+
+    # Log-probabilities of the generated tokens, ignoring padding after the end of the sequence
+    scores = model.compute_transition_scores(out.sequences, out.scores, normalize_logits=True)
+    scores[out.sequences[:, 1:] == processor.tokenizer.pad_token_id] = 0
+    confianzas = scores.sum(dim=1).exp().tolist()
+
+    textos = [txt.replace('&', '8') for txt in processor.batch_decode(out.sequences, skip_special_tokens=True)]
+    return list(zip(textos, confianzas))
+
+
+def captcha_aceptable(texto:str, confianza:float, umbral:float=0.6) -> bool:
+    """
+    Submit the captcha only if the model is confident and the text has the expected shape
+    """
+    return confianza >= umbral and captcha_patron.fullmatch(texto_captcha(texto)) is not None
+
+
+def texto_captcha(texto:str) -> str:
+    """
+    Captcha reading without whitespace, as it is validated and typed in the page
+    """
+    return ''.join(texto.split())
+
+
+def png_to_img(image_binary:bytes):
+    return Image.open(io.BytesIO(image_binary)).convert('RGB')
+
+
+def session_from_driver(driver, session=None, pool_size:int=8) -> requests.Session:
+    """
+    Copy the cookies and user agent of the driver into a `requests` session with keep-alive
+    """
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.verify = False
+    session.headers['User-Agent'] = driver.execute_script("return navigator.userAgent;")
+    for cookie in driver.get_cookies():
+        session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain'), path=cookie.get('path', '/'))
+    return session
+
+
+def fetch_resultados(session:requests.Session, url:str) -> list:
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore')
+        r = session.get(url, timeout=10)
+    r.raise_for_status()
+    return r.json()['data']
 
 
-def get_table_response(driver, comando:str, cedula:str) -> list:
+def get_table_response(driver, comando:str, cedula:str, session=None) -> list:
+    """
+    Download the WFResultados pages of the last search. With a session the pages are fetched
+    concurrently over HTTP, otherwise the driver navigates to each one of them.
+    """
     network_data = driver.execute_script(comando)
     urls = [dct['name'] for dct in network_data if 'WFResultados' in dct['name']]
 
-    response = []
-    for url in urls:
-        driver.get(url)
-        textoel = WebDriverWait(driver, 5).until(EC.visibility_of_element_located((By.TAG_NAME, 'body')))
-        values = json.loads(textoel.text)['data']
+    if session is not None:
+        session = session_from_driver(driver, session)
+        with ThreadPoolExecutor(max_workers=max(1, min(len(urls), 8))) as executor:
+            pages = list(executor.map(lambda url: fetch_resultados(session, url), urls))
+    else:
+        pages = []
+        for url in urls:
+            driver.get(url)
+            textoel = WebDriverWait(driver, 5).until(EC.visibility_of_element_located((By.TAG_NAME, 'body')))
+            pages.append(json.loads(textoel.text)['data'])
 
+    response = []
+    for values in pages:
         if len(values) > 0:
             response += values
 
@@ -42,31 +148,116 @@ return networkData;
 """
 
 
-def registros_contraloria(cedula:str, antes15:bool, driver, processor, model) -> dict:
+class Tiempos:
+    """
+    Wall-clock time of each phase of a query, emitted as a JSON record to the `tiempos` logger
+    and recorded in the `scrap_fase_segundos` and `scrap_consulta_segundos` histograms
+    """
+    def __init__(self, **campos):
+        self.record = dict(campos)
+        self.inicio = time.perf_counter()
+
+    @contextmanager
+    def fase(self, nombre:str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            segundos = time.perf_counter() - t0
+            self.record[nombre] = round(segundos, 4)
+            metricas.observar('scrap_fase_segundos', segundos, fase=nombre)
+
+    def emit(self, **campos):
+        self.record.update(campos)
+        self.record['total'] = round(time.perf_counter() - self.inicio, 4)
+        tiempos_log.info(json.dumps(self.record))
+        metricas.observar('scrap_consulta_segundos', self.record['total'])
+        metricas.contar('scrap_consultas_total', estado='ok' if self.record.get('estado') else 'fallida')
+
+
+def log_tiempos_to(path):
+    """
+    Append the timing records of this process to the JSONL file at path
+    """
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    tiempos_log.addHandler(handler)
+    tiempos_log.setLevel(logging.INFO)
+
+
+def captcha_loaded(driver):
+    """
+    Wait condition: the captcha image finished loading
+    """
+    imagen = driver.find_element(By.ID, 'captcha')
+    return driver.execute_script("return arguments[0].complete && arguments[0].naturalWidth > 0;", imagen)
+
+
+def refresh_captcha(driver):
+    """
+    Ask for a new captcha without reloading the page, adding a cache buster to the query of the image
     """
-    Return a list with all the entries found for cedula
+    imagen = driver.find_element(By.ID, 'captcha')
+    driver.execute_script(
+        "var src = arguments[0].src.replace(/([?&])_=\\d*&?/, '$1').replace(/[?&]$/, '');"
+        "arguments[0].src = src + (src.indexOf('?') < 0 ? '?' : '&') + '_=' + Date.now();", imagen
+    )
+    WebDriverWait(driver, 5).until(captcha_loaded)
+
+
+def alert_or_results(driver):
+    """
+    Wait condition: either an alert popped up or the results table has content
+    """
+    if EC.alert_is_present()(driver):
+        return True
+    tbody = driver.find_elements(By.CSS_SELECTOR, '#tblBusquedaResultados tbody')
+    return len(tbody) > 0 and tbody[0].text.strip() != ''
+
+
+def registros_contraloria(cedula:str, antes15:bool, driver, solver, session=None, max_refresh:int=3,
+                          ritmo=sin_ritmo) -> dict:
+    """
+    Return a list with all the entries found for cedula. `solver` maps the png bytes of the
+    captcha to `(text, confidence)`, see `captcha_server.remote_solver`.
+    Captchas that fail `captcha_aceptable` are refreshed in the page up to `max_refresh` times.
+    If `session` is given the result pages are fetched over HTTP, see `session_from_driver`
     """
+    tiempos = Tiempos(cedula=cedula, antes15=antes15, tasa=ritmo.estado().get('tasa'))
 
     # Open start page
-    driver.get('https://www.contraloria.gob.ec/Consultas/DeclaracionesJuradas')
-    time.sleep(1)
+    with tiempos.fase('page_load'):
+        driver.get(contraloria_url('/Consultas/DeclaracionesJuradas'))
+        ced_element = WebDriverWait(driver, 5).until(EC.visibility_of_element_located((By.ID, 'txtCedula')))
+        WebDriverWait(driver, 5).until(captcha_loaded)
 
     # Send cedula
-    ced_element = WebDriverWait(driver, 5).until(EC.visibility_of_element_located((By.ID, 'txtCedula')))
     ced_element.send_keys(cedula)
 
-    # Try to decode captcha
-    image_binary = driver.find_element(By.ID, 'captcha').screenshot_as_png
-    img = Image.open(io.BytesIO(image_binary)).convert('RGB')
-    driver.find_element(By.ID, 'x').send_keys(solve_captcha(img, processor, model))
+    # Try to decode captcha, ask for a new one if the reading is doubtful
+    for intento in range(max_refresh + 1):
+        if intento > 0:
+            with tiempos.fase('captcha_refresh'):
+                refresh_captcha(driver)
+        with tiempos.fase('captcha_screenshot'):
+            image_binary = driver.find_element(By.ID, 'captcha').screenshot_as_png
+        with tiempos.fase('ocr'):
+            texto, confianza = solver(image_binary)
+        if captcha_aceptable(texto, confianza):
+            break
+        print(f"Low confidence captcha ({confianza:.2f}), refreshing")
+    tiempos.record.update(refrescos=intento, confianza=round(confianza, 4))
+    metricas.contar('captcha_refrescos_total', intento)
+    driver.find_element(By.ID, 'x').send_keys(texto_captcha(texto))
 
     # Look elements before 2015
     if antes15:
         driver.find_element(By.ID, 'rdoHistorico_1').click()
 
     # Send `buscar` click
-    driver.find_element(By.ID, 'btnBuscar_in').click()
-    time.sleep(1)
+    with tiempos.fase('submit'):
+        driver.find_element(By.ID, 'btnBuscar_in').click()
+        WebDriverWait(driver, 10).until(alert_or_results)
 
     # Check if I got correctly the code
     try:
@@ -74,17 +265,126 @@ def registros_contraloria(cedula:str, antes15:bool, driver, processor, model) ->
         driver.switch_to.alert.accept()
         if 'incorrecto' in alerta:
             print("Wrong captcha!")
+            metricas.contar('captcha_total', resultado='incorrecto')
+            tiempos.emit(estado=False)
             return {'estado': False}
     except NoAlertPresentException:
         print("Correct Captcha")
+        metricas.contar('captcha_total', resultado='correcto')
         pass
 
     # Check if there is info before 2015
     tabla = driver.find_element(By.ID, 'tblBusquedaResultados').find_element(By.TAG_NAME, 'tbody').text
     if tabla == 'Sin resultados':
         print(f"Sin resultados {'antes 2015' if antes15 else 'after 2015'}")
+        tiempos.emit(estado=True)
         return {'estado': True, 'res': [[cedula] + ['No data' for _ in range(7)]]}
     else:
         print(f"Collected results {cedula}")
-        return {'res': get_table_response(driver, js_script, cedula), 'estado': True}
+        with tiempos.fase('result_fetch'):
+            res = get_table_response(driver, js_script, cedula, session)
+        tiempos.emit(estado=True)
+        return {'res': res, 'estado': True}
+
+
+# Preferences of the scraping profile: no fonts, cache, prefetch or background services
+prefs_ligero = {
+    'browser.display.use_document_fonts': 0,
+    'gfx.downloadable_fonts.enabled': False,
+    'browser.cache.disk.enable': False,
+    'browser.cache.memory.capacity': 16384,
+    'browser.sessionhistory.max_entries': 2,
+    'browser.sessionhistory.max_total_viewers': 0,
+    'network.prefetch-next': False,
+    'network.dns.disablePrefetch': True,
+    'network.http.speculative-parallel-limit': 0,
+    'media.autoplay.default': 5,
+    'dom.ipc.processCount': 1,
+    'fission.autostart': False,
+    'browser.safebrowsing.malware.enabled': False,
+    'browser.safebrowsing.phishing.enabled': False,
+    'datareporting.policy.dataSubmissionEnabled': False,
+    'toolkit.telemetry.enabled': False,
+    'app.update.auto': False,
+    'extensions.pocket.enabled': False,
+}
+
 
+@lru_cache(maxsize=None)
+def geckodriver_path() -> str:
+    return GeckoDriverManager().install()
+
+
+def start_driver(x0:int=0, y0:int=0, headless:bool=False, ligero:bool=False, permitir:str='captcha'):
+    """
+    Start a Firefox driver with the window at (x0, y0). With `ligero` the profile does not load
+    fonts, styles or images other than the captcha (images whose url matches permitir, see `bloqueo`)
+    """
+    options = webdriver.FirefoxOptions()
+    if headless:
+        options.add_argument('-headless')
+    if ligero:
+        for pref, valor in prefs_ligero.items():
+            options.set_preference(pref, valor)
+
+    driver = webdriver.Firefox(service=Service(geckodriver_path()), options=options)
+    if ligero:
+        driver.install_addon(extension_bloqueo(permitir), temporary=True)
+    if not headless:
+        driver.set_window_rect(x=x0, y=y0)
+    return driver
+
+
+def driver_memoria(driver) -> float:
+    """
+    Resident memory in MB of the Firefox of driver and its content processes, None without psutil
+    """
+    if psutil is None:
+        return None
+    try:
+        proceso = psutil.Process(driver.capabilities['moz:processID'])
+        procesos = [proceso] + proceso.children(recursive=True)
+        return sum(p.memory_info().rss for p in procesos) / 2**20
+    except (KeyError, psutil.Error):
+        return None
+
+
+def get_data(cedula:str, antes15:bool, driver, solver, session=None, ritmo=sin_ritmo) -> dict:
+    """
+    `registros_contraloria` paced by ritmo (see `ritmo.Ritmo`). Timeouts, unexpected alerts and
+    HTTP errors are reported to ritmo as failures; a wrong captcha is not a server problem.
+    """
+    ritmo.esperar()
+    t0 = time.perf_counter()
+    try:
+        r = registros_contraloria(cedula, antes15, driver, solver, session, ritmo=ritmo)
+    except UnexpectedAlertPresentException:
+        print("Error de alerta no presente!")
+        metricas.contar('scrap_errores_total', tipo='alerta')
+        ritmo.fallo()
+        return {'estado': False}
+    except TimeoutException:
+        print("Timeout esperando la pagina!")
+        metricas.contar('scrap_errores_total', tipo='timeout')
+        ritmo.fallo()
+        return {'estado': False}
+    except requests.RequestException as e:
+        print(f"Error descargando resultados: {e}")
+        metricas.contar('scrap_errores_total', tipo='http')
+        ritmo.fallo()
+        return {'estado': False}
+
+    ritmo.exito(time.perf_counter() - t0)
+    return r
+
+
+def scrap_busqueda(cedula:str, antes15:bool, driver, solver, session=None, ritmo=sin_ritmo) -> pd.DataFrame:
+    """
+    Return the registros of cedula in one search, before or after 2015, trying until it works
+    """
+    r = get_data(cedula, antes15, driver, solver, session, ritmo)
+    while not r['estado']:
+        print(f"Try again with {cedula}")
+        metricas.contar('scrap_reintentos_total')
+        r = get_data(cedula, antes15, driver, solver, session, ritmo)
+    return pd.DataFrame(r['res'], columns=columnas)
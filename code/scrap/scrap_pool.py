@@ -0,0 +1,203 @@
+"""
+Pool of Firefox workers that share a single queue of cedulas and a single captcha solver
+"""
+
+import multiprocessing as mp
+import traceback
+
+import pandas as pd
+
+from selenium.common.exceptions import WebDriverException
+from urllib3.exceptions import HTTPError
+
+from scrap_funcs import start_driver, driver_memoria, scrap_busqueda, session_from_driver, log_tiempos_to
+from bloqueo import borrar_extensiones
+from captcha_server import captcha_server, remote_solver
+from ritmo import sin_ritmo
+from metricas import metricas
+
+# Browser of the workers: headless lean profile, restarted every `max_consultas` searches or when
+# Firefox uses more than `max_memoria_mb`, and at most `max_reinicios` restarts after a crash per search
+perfil_default = {
+    'headless': True,
+    'ligero': True,
+    'max_consultas': 300,
+    'max_memoria_mb': 1500,
+    'max_reinicios': 3,
+}
+
+# Errors raised when the browser or geckodriver died
+errores_driver = (WebDriverException, HTTPError, ConnectionError)
+
+
+def window_position(worker_id:int) -> tuple:
+    """
+    Tile the windows of the workers on the screen
+    """
+    return 200 * (worker_id % 3), 200 * (worker_id // 3 % 3)
+
+
+def cerrar_driver(driver):
+    try:
+        driver.quit()
+    except Exception:
+        pass
+
+
+def scrap_worker(worker_id:int, tareas, resultados, solver, http:bool=True, tiempos_dir=None, perfil:dict=None,
+                 ritmo=sin_ritmo, metricas_path:str=None):
+    """
+    Take searches `(cedula, antes15)` from `tareas` until a `None` arrives and send the registros to
+    `resultados`. Messages are tuples `(worker_id, busqueda, registros)`; `busqueda=None` means the worker finished.
+    With `http` the result pages are downloaded with a pooled session instead of the browser.
+    The timing of each query goes to `tiempos_dir/tiempos_worker{worker_id}.jsonl`.
+    The browser is recycled and restarted after crashes as set in `perfil`, see `perfil_default`.
+    Queries are paced by ritmo, shared by all the workers (see `ritmo.Ritmo`).
+    The metrics of the worker are written to `metricas_path.format(worker_id=worker_id)`.
+    """
+    perfil = {**perfil_default, **(perfil or {})}
+    driver, session, consultas = None, None, 0
+
+    def nuevo_driver():
+        nonlocal driver
+        driver = start_driver(*window_position(worker_id), headless=perfil['headless'], ligero=perfil['ligero'])
+        return driver, (session_from_driver(driver) if http else None), 0
+
+    try:
+        if tiempos_dir is not None:
+            log_tiempos_to(f"{tiempos_dir}/tiempos_worker{worker_id}.jsonl")
+        if metricas_path is not None:
+            metricas_path = metricas_path.format(worker_id=worker_id)
+            metricas.etiquetas['worker'] = worker_id
+            metricas.escribir_cada(metricas_path)
+
+        for busqueda in iter(tareas.get, None):
+            cedula, antes15 = busqueda
+            print(f"Worker {worker_id} working on {cedula} {'before' if antes15 else 'after'} 2015 -----------------------")
+
+            # Recycle the browser before it grows too much
+            memoria = driver_memoria(driver) if driver is not None else None
+            if memoria is not None:
+                metricas.medir('firefox_memoria_mb', round(memoria, 1))
+            if driver is not None and (consultas >= perfil['max_consultas'] or (memoria or 0) > perfil['max_memoria_mb']):
+                print(f"Worker {worker_id} restarting Firefox after {consultas} searches ({memoria or 0:.0f} MB)")
+                metricas.contar('driver_reinicios_total', motivo='reciclaje')
+                cerrar_driver(driver)
+                driver = None
+
+            # Resume the same search in a new browser if this one crashed. Starting the browser
+            # can fail too, each attempt counts towards `max_reinicios`
+            for reinicio in range(perfil['max_reinicios'] + 1):
+                try:
+                    if driver is None:
+                        driver, session, consultas = nuevo_driver()
+                    registros = scrap_busqueda(cedula, antes15, driver, solver, session, ritmo)
+                    break
+                except errores_driver:
+                    traceback.print_exc()
+                    print(f"Worker {worker_id} lost Firefox with {cedula}, restarting")
+                    metricas.contar('driver_reinicios_total', motivo='caida')
+                    if driver is not None:
+                        cerrar_driver(driver)
+                        driver = None
+            else:
+                # Not in the log, so it is queried again in the next run
+                print(f"Worker {worker_id} gives up on {cedula}")
+                metricas.contar('busquedas_abandonadas_total')
+                continue
+
+            consultas += 1
+            resultados.put((worker_id, busqueda, registros))
+
+    except Exception:
+        traceback.print_exc()
+
+    finally:
+        if driver is not None:
+            cerrar_driver(driver)
+        borrar_extensiones()
+        if metricas_path is not None:
+            metricas.escribir(metricas_path)
+        resultados.put((worker_id, None, None))
+
+
+def pool_worker(worker_id:int, tareas, resultados, solicitudes, respuesta, http:bool, tiempos_dir, perfil, ritmo,
+                metricas_path):
+    solver = remote_solver(worker_id, solicitudes, respuesta)
+    scrap_worker(worker_id, tareas, resultados, solver, http, tiempos_dir, perfil, ritmo, metricas_path)
+
+
+def consultar_siempre(cedula:str) -> bool:
+    return True
+
+
+def historico_por_inicio(path, anio:int=2015):
+    """
+    Policy for `run_pool`: skip the search before 2015 of the officials whose earliest known
+    start date (`start_date` as YYYYMM in the parquet at path) is after `anio`
+    """
+    inicios = pd.read_parquet(path, columns=['cedula', 'start_date']).astype(str)
+    anios = pd.to_numeric(inicios['start_date'].str[:4], errors='coerce')
+    primer_anio = anios.groupby(inicios['cedula']).min()
+    sin_historico = set(primer_anio.index[primer_anio > anio])
+    return lambda cedula: cedula not in sin_historico
+
+
+def run_pool(cedulas:list, n_workers:int, max_batch:int=8, ventana:float=0.05, http:bool=True,
+             tiempos_dir=None, lector=None, perfil:dict=None, consultar_historico=consultar_siempre,
+             ritmo=sin_ritmo, metricas_path:str=None):
+    """
+    Scrap all cedulas with `n_workers` browsers. The searches before and after 2015 of a cedula
+    are handed out as separate tasks, so two workers run them at the same time, and a worker that
+    gets stuck with wrong captchas does not hold back the rest of the list. The search before 2015
+    is skipped when `consultar_historico(cedula)` is False, see `historico_por_inicio`.
+    Yields `(cedula, registros)` as soon as both searches of the cedula are done. `lector` replaces
+    the captcha model, see `captcha_server`, `perfil` overrides the browser settings in `perfil_default`
+    and `ritmo` paces the queries of all the workers, see `ritmo.Ritmo`. Each worker writes its
+    metrics to `metricas_path` with `{worker_id}` filled in, see `metricas.Metricas`.
+    """
+    tareas = mp.Queue()
+    resultados = mp.Queue()
+    pendientes = {}
+    for cedula in cedulas:
+        busquedas = [True, False] if consultar_historico(cedula) else [False]
+        pendientes[cedula] = {antes15: None for antes15 in busquedas}
+        for antes15 in busquedas:
+            tareas.put((cedula, antes15))
+    for _ in range(n_workers):
+        tareas.put(None)
+
+    # Captcha solver shared by all the workers
+    solicitudes = mp.Queue()
+    respuestas = {i: mp.Queue() for i in range(n_workers)}
+    server = mp.Process(target=captcha_server, args=(solicitudes, respuestas, max_batch, ventana, lector))
+    server.start()
+
+    workers = [
+        mp.Process(target=pool_worker, args=(i, tareas, resultados, solicitudes, respuestas[i], http, tiempos_dir,
+                                             perfil, ritmo, metricas_path))
+        for i in range(n_workers)
+    ]
+    for w in workers:
+        w.start()
+
+    activos = n_workers
+    while activos > 0:
+        worker_id, busqueda, registros = resultados.get()
+        if busqueda is None:
+            print(f"Done with worker {worker_id}!!!")
+            activos -= 1
+            continue
+
+        # Join the two searches of the cedula, before 2015 first
+        cedula, antes15 = busqueda
+        partes = pendientes[cedula]
+        partes[antes15] = registros
+        if all(p is not None for p in partes.values()):
+            del pendientes[cedula]
+            yield cedula, pd.concat([partes[a] for a in [True, False] if a in partes], ignore_index=True)
+
+    for w in workers:
+        w.join()
+    solicitudes.put(None)
+    server.join()
@@ -0,0 +1,67 @@
+"""
+Tests of the blocking extension of the lean Firefox profile. The background script is run with
+node against a stub of the `browser` API. Run from the root of the project:
+
+    python -m pytest code/tests
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import zipfile
+
+import pytest
+from pyprojroot import here
+
+sys.path.append((here()/'code/scrap').as_posix())
+from bloqueo import background_js, extension_bloqueo, borrar_extensiones
+
+# Registers the listener through a stub of `browser` and answers the requests read from stdin
+stub_browser = """
+let listener = null, filtro = null, opciones = null;
+const browser = {webRequest: {onBeforeRequest: {addListener: (f, r, o) => { listener = f; filtro = r; opciones = o; }}}};
+%s
+const peticiones = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+console.log(JSON.stringify({
+  registrado: listener !== null, filtro: filtro, opciones: opciones,
+  cancelar: peticiones.map(d => listener(d).cancel),
+}));
+"""
+
+peticiones = [
+  ({'type': 'image', 'url': 'https://www.contraloria.gob.ec/Consultas/Captcha?_=1'}, False),
+  ({'type': 'image', 'url': 'https://www.contraloria.gob.ec/Consultas/CAPTCHA.ashx'}, False),
+  ({'type': 'image', 'url': 'https://www.contraloria.gob.ec/img/logo.png'}, True),
+  ({'type': 'stylesheet', 'url': 'https://www.contraloria.gob.ec/css/captcha.css'}, True),
+  ({'type': 'font', 'url': 'https://fonts.example.com/font.woff2'}, True),
+]
+
+
+def correr_background(script:str) -> dict:
+  if shutil.which('node') is None:
+    pytest.skip('node not found')
+  r = subprocess.run(['node', '-e', stub_browser % script], input=json.dumps([d for d, _ in peticiones]),
+                     capture_output=True, text=True, timeout=30)
+  assert r.returncode == 0, r.stderr
+  return json.loads(r.stdout)
+
+
+def test_background_registra_listener():
+  res = correr_background(background_js('captcha'))
+  assert res['registrado']
+  assert res['opciones'] == ['blocking']
+  assert set(res['filtro']['types']) >= {'image', 'stylesheet', 'font'}
+  assert res['cancelar'] == [cancelar for _, cancelar in peticiones]
+
+
+def test_xpi_contiene_background():
+  try:
+    path = extension_bloqueo('captcha')
+    with zipfile.ZipFile(path) as xpi:
+      assert json.loads(xpi.read('manifest.json'))['background'] == {'scripts': ['background.js']}
+      assert xpi.read('background.js').decode() == background_js('captcha')
+  finally:
+    borrar_extensiones()
+  assert not os.path.exists(os.path.dirname(path))
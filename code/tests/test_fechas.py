@@ -0,0 +1,37 @@
+"""
+Tests of the parsing of fecha inicio over the corpus of real desde values. Run from the root of the project:
+
+    python -m pytest code/tests
+"""
+
+import sys
+
+import pandas as pd
+from pyprojroot import here
+
+sys.path.append((here()/'code/txt_extraction').as_posix())
+from fechas_funcs import parse_desde, parse_desde_col, validar_corpus
+
+corpus_path = here()/"data/raw/desde_corpus.csv"
+
+
+def test_corpus_desde():
+  fallos = validar_corpus(corpus_path)
+  assert fallos.empty, fallos.to_string()
+
+
+def test_parse_desde_col_igual_a_parse_desde():
+  desde = pd.read_csv(corpus_path, dtype=str, keep_default_na=False)['desde']
+  desde = pd.concat([desde, desde.iloc[::-1]], ignore_index=True)
+  partes = parse_desde_col(desde)
+  assert partes.index.equals(desde.index)
+  for valor, fila in zip(desde, partes.itertuples(index=False)):
+    esperado = [None if pd.isna(v) else v for v in parse_desde(valor)]
+    assert [None if pd.isna(v) else v for v in fila] == esperado, valor
+
+
+def test_parse_desde_col_faltantes():
+  partes = parse_desde_col(pd.Series([None, '2013-07-01'], index=[5, 7]))
+  assert list(partes.index) == [5, 7]
+  assert partes.loc[5].isna().all()
+  assert partes.loc[7, 'from_nodash'] == '20130701'
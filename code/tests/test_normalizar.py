@@ -0,0 +1,48 @@
+"""
+Tests of the normalization of the string columns. Run from the root of the project:
+
+    python -m pytest code/tests
+"""
+
+import sys
+
+import pandas as pd
+import pytest
+from pyprojroot import here
+
+sys.path.append((here()/'code').as_posix())
+from normalizar import limpiar, categorica, limpiar_categorias
+
+
+@pytest.mark.parametrize('texto, esperado', [
+  ('juez', 'JUEZ'),
+  ('  Juez   de lo\tPenal \n', 'JUEZ DE LO PENAL'),
+  ('Niñez y Adolescencia', 'NINEZ Y ADOLESCENCIA'),
+  ('FISCALÍA', 'FISCALIA'),
+  ('', ''),
+])
+def test_limpiar(texto, esperado):
+  assert limpiar(texto) == esperado
+
+
+def test_categorica_ordena_categorias():
+  serie = pd.Series(['b', 'a', None, 'c', 'a'])
+  cat = categorica(serie)
+  assert list(cat.cat.categories) == ['a', 'b', 'c']
+  assert cat.astype(object).where(cat.notna(), None).tolist() == ['b', 'a', None, 'c', 'a']
+
+
+def test_categorica_reordena_categorical():
+  serie = pd.Series(pd.Categorical(['b', 'a'], categories=['b', 'a']))
+  cat = categorica(serie)
+  assert list(cat.cat.categories) == ['a', 'b']
+  assert cat.tolist() == ['b', 'a']
+  assert categorica(cat) is cat
+
+
+def test_limpiar_categorias_une_valores():
+  serie = pd.Series([' juez', 'JUEZ', None, 'fiscal  ', 'Fiscal'], name='cargo')
+  limpias = limpiar_categorias(serie)
+  assert list(limpias.cat.categories) == ['FISCAL', 'JUEZ']
+  assert limpias.astype(object).where(limpias.notna(), None).tolist() == ['JUEZ', 'JUEZ', None, 'FISCAL', 'FISCAL']
+  assert limpias.name == 'cargo'
@@ -0,0 +1,86 @@
+"""
+Tests of the rule engine that reclassifies the cargos as juez or fiscal. Run from the root of the project:
+
+    python -m pytest code/tests
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+from pyprojroot import here
+
+sys.path.append((here()/'code').as_posix())
+sys.path.append((here()/'code/scrap').as_posix())
+from reglas_cargos import aplicar_reglas
+
+
+def registros(filas:list, index=None) -> pd.DataFrame:
+  """
+  Registros as they reach `aplicar_reglas` in `03_clean_registros.py`: the fuzzy match and score
+  """
+  return pd.DataFrame(filas, columns=['cargo', 'institucion', 'match', 'score'], index=index)
+
+
+def test_orden_de_reglas():
+  df = aplicar_reglas(registros([
+    ['SECRETARIO DEL JUEZ', 'CONSEJO DE LA JUDICATURA', 'juez', 80.0],
+    ['JUEZ DE LO PENAL', 'CONSEJO DE LA JUDICATURA', 'juez', 90.0],
+    ['ASISTENTE DEL JUEZ', 'CONSEJO DE LA JUDICATURA', 'otro', 60.0],
+  ]))
+
+  # `secretario` comes after `juez_palabra`, so it has the last word
+  assert df.loc[0, 'match'] == 'otro'
+  assert np.isnan(df.loc[0, 'score'])
+  assert df.loc[0, 'reglas'] == 'juez_palabra;secretario'
+
+  # `juez_inicio` sets the score to 100, so `juez_palabra` does not fire after it
+  assert (df.loc[1, 'match'], df.loc[1, 'score']) == ('juez', 100)
+  assert df.loc[1, 'reglas'] == 'juez_inicio'
+
+  assert (df.loc[2, 'match'], df.loc[2, 'score']) == ('juez', 100)
+  assert df.loc[2, 'reglas'] == 'juez_palabra'
+
+
+def test_cuando_con_faltantes():
+  df = aplicar_reglas(registros([
+    ['MINISTRO', 'MUNICIPIO DE QUITO', 'otro', np.nan],
+    ['MINISTRO', 'MINISTERIO PUBLICO', 'otro', 40.0],
+    ['ASISTENTE', 'MINISTERIO PUBLICO', 'otro', np.nan],
+    ['ABOGADO', 'MUNICIPIO DE QUITO', 'fiscal', 50.0],
+  ]))
+
+  # Without fiscalia `fiscalia == 1` is false, and without score `score < 55` is false
+  assert df.loc[0, 'reglas'] == ''
+  assert df.loc[0, 'match'] == 'otro'
+  assert np.isnan(df.loc[0, 'fiscalia'])
+
+  assert df.loc[1, 'fiscalia'] == 1
+  assert (df.loc[1, 'match'], df.loc[1, 'score']) == ('fiscal', 100)
+  assert df.loc[1, 'reglas'] == 'ministerio_publico;ministro_fiscal'
+
+  # A missing score does not fire the rules on low scores inside fiscalia
+  assert df.loc[2, 'reglas'] == 'ministerio_publico'
+  assert df.loc[2, 'match'] == 'otro'
+
+  assert df.loc[3, 'match'] == 'otro'
+  assert df.loc[3, 'reglas'] == 'score_bajo'
+
+
+def test_columna_reglas():
+  entrada = registros([
+    ['AGENTE FISCAL', 'FISCALIA GENERAL DEL ESTADO', 'fiscal', 85.0],
+    [None, None, np.nan, np.nan],
+    ['', 'TRIBUNAL PENAL', 'otro', np.nan],
+  ], index=[10, 20, 30])
+  df = aplicar_reglas(entrada)
+
+  assert list(df.index) == [10, 20, 30]
+  assert df['reglas'].tolist() == ['fiscal_inicio;fiscalia_inicio', '', 'judicatura;sin_cargo']
+  assert (df.loc[10, 'match'], df.loc[10, 'score'], df.loc[10, 'fiscalia']) == ('fiscal', 100, 1)
+  assert df.loc[30, 'fiscalia'] == 0
+  assert pd.isna(df.loc[30, 'match'])
+
+  # The input is not modified
+  assert 'reglas' not in entrada.columns
+  assert entrada.loc[10, 'score'] == 85.0
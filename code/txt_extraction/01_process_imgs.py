@@ -1,136 +1,105 @@
 import pandas as pd
-import numpy as np
-import base64
-import requests
-from bs4 import BeautifulSoup
-import warnings
 
-import pytesseract
-pytesseract.pytesseract.tesseract_cmd = r'C:/Program Files/Tesseract-OCR/tesseract'
-
-from PIL import Image
-import io
 from pyprojroot import here
 
-
-# RELEVANT FUNCTIONS ======================================================================
-
-
-def get_imgs(cedula:str, declaracion:str) -> dict:
-  """
-  Return a list containing the binary information of the images
-  """
-
-  # Get data
-  url = f"https://www.contraloria.gob.ec/sistema/WFDeclaracionTemporal.aspx?xx=99&id={cedula}&td={declaracion}"
-  with warnings.catch_warnings():
-    warnings.filterwarnings('ignore')
-    r = requests.get(url, verify=False)
-
-  # Read data
-  if r.ok:
-    soup = BeautifulSoup(r.content, 'html.parser')
-    results = {}
-    for idx, val in enumerate(soup.find_all('img')):
-      imgdata = val['src']
-      imgdata = imgdata[imgdata.find(',') + 1:]
-      imgdata = base64.b64decode(imgdata)
-      results[f"img{idx}"] = np.frombuffer(imgdata, np.uint8)
-
-    return results
-
-  else:
-    return {'img0': "No data"}
-
-
-def txt_box(pos:list, data:pd.DataFrame) -> str:
-  vals = data.query(f"x0>={pos[0]} and y0>={pos[1]} and x1<={pos[2]} and y1<={pos[3]}").text
-  return ' '.join(vals)
-
-
-# Define function to get data
-def img_to_data(imagen, positions) -> dict:
-  """
-  Convert image to data based on the positions
-  """
-  # Read image
-  datos = pytesseract.image_to_data(imagen)
-
-  # Convert encoding to pandas
-  lines = datos.split('\n')
-  data = []
-  header = lines[0].split('\t')
-  for line in lines[1:]:
-    values = line.split('\t')
-    data.append(dict(zip(header, values)))
-  data = pd.DataFrame(data)
-
-  # Clean data
-  data = data.loc[(data['conf'].astype(float) > 0)].reset_index(drop=True)
-  data[['left', 'top', 'width', 'height']] = data[['left', 'top', 'width', 'height']].astype(int)
-  data['x1'] = data['left'] + data['width']
-  data['y1'] = data['top'] + data['height']
-  data = data.rename(columns={'left': 'x0', 'top': 'y0'})[['text', 'x0', 'y0', 'x1', 'y1']]
-
-  # Return data if 1st image
-  res = {}
-  for cargo, pos in positions.items():
-    res[cargo] = txt_box(pos, data)
-
-  return res
-
-
-# LOAD POSITIONS =====================================================================
-positions = pd.read_excel(here()/"data/raw/positions.xlsx")
-positions = positions.groupby('field').agg(x0=('x0', 'min'), y0=('y0', 'min'), x1=('x1', 'max'), y1=('y1', 'max'))
-
-# Convert ot dictionary
-positions['pos'] = positions[['x0', 'y0', 'x1', 'y1']].apply(lambda row: list(row), axis=1)
-positions = positions[['pos']].to_dict()['pos']
-
-# LOAD DATA =================================================================
-
-# Define process
-cpu = "4"
-registros = pd.read_parquet(here()/f"data/temp/registros{cpu}.parquet")
-registros = registros.loc[(registros['iddoc'] != '0') & (registros['iddoc'] != 'No data')].reset_index(drop=True)
-
-if 'estado' in registros.columns:
-  faltantes = registros.loc[registros['estado'] == 0].reset_index(drop=True).copy()
-else:
-  faltantes = registros.copy()
-
-# RUN IMAGE EXTRACTION =================================================================
-
-res = []
-for row in faltantes.iterrows():
-  # Define cedula and doc to look for
-  cedula = row[1]['cedula']
-  iddoc = row[1]['iddoc']
-
-  # Get First Image
-  imagen_bytes = get_imgs(cedula, iddoc)['img0']
-
-  # Check if image exist
-  if type(imagen_bytes) == str:
-    r = {'cedula': cedula, 'iddoc': iddoc}
-    print(f"No doc for cedula: {cedula}, and doc {iddoc} ---- CPU: {cpu}")
-
-  # If exists extract data
-  else:
-    imagen = Image.open(io.BytesIO(imagen_bytes))
-    r = img_to_data(imagen, positions)
-    r['cedula'] = cedula
-    r['iddoc'] = iddoc
-    print(f"Done with cedula: {cedula}, and doc {iddoc} ---- CPU: {cpu}")
-
-  # Append to list
-  res.append(r)
-
-  # Update estado
-  faltantes.loc[faltantes.index == row[0], 'estado'] = 1
-
-
-# Save data
-pd.DataFrame(res).to_parquet(here()/f"data/temp/datos_contraloria.parquet", index=False)
-
+import sys
+sys.path.append((here()/'code').as_posix())
+from normalizar import a_categorias
+from ritmo import Ritmo
+from metricas import metricas, Progreso
+
+from img_funcs import make_session, fetch_imgs, ocr_imgs, load_positions
+from img_cache import ImgCache
+from chunk_store import done_pairs, write_chunks, compact_chunks
+
+# Number of simultaneous downloads
+max_downloads = 8
+
+# Pace of the downloads, in requests per second (see `ritmo.Ritmo`)
+ritmo_inicial, ritmo_maximo = 2, 20
+
+# Number of tesseract processes
+ocr_workers = 4
+
+# Read only the boxes of the fields instead of the whole page
+ocr_roi = False
+
+# Rows per parquet chunk
+chunk_size = 500
+
+# Later pages to read (assets/liabilities): `{page: sheet of positions.xlsx}`
+extra_sheets = {}
+
+# Metrics of the run, `.prom` (Prometheus text) or `.jsonl` file
+metricas_path = here()/"data/temp/metricas/imgs.prom"
+
+
+if __name__ == '__main__':
+
+  # Local copy of the images: with `offline=True` only cached declaraciones are processed
+  cache = ImgCache(here()/"data/temp/img_cache", max_bytes=20 * 2**30, offline=False)
+
+  # LOAD POSITIONS =====================================================================
+  positions = load_positions(here()/"data/raw/positions.xlsx")
+  extra_pages = {page: load_positions(here()/"data/raw/positions.xlsx", sheet) for page, sheet in extra_sheets.items()}
+
+  # LOAD DATA =================================================================
+
+  # Declaraciones in the compacted log of `scrap/02_scrap_contraloria.py`
+  registros = pd.read_parquet(here()/"data/wscrap/registros_raw.parquet", columns=['cedula', 'iddoc'])
+  registros = registros.loc[registros['iddoc'].notna() & (registros['iddoc'] != '0') & (registros['iddoc'] != 'No data')]
+  registros = registros.astype(str).drop_duplicates(ignore_index=True)
+
+  # Skip documents already written
+  hechos = done_pairs(here()/"data/temp/datos_contraloria")
+  faltantes = registros.loc[[par not in hechos for par in zip(registros['cedula'], registros['iddoc'])]]
+  print(f"{len(faltantes)} documents left")
+
+  # RUN IMAGE EXTRACTION =================================================================
+  # fetch -> decode -> OCR -> write, each step keeps a bounded number of documents in flight
+
+  metricas_path.parent.mkdir(parents=True, exist_ok=True)
+  metricas.escribir_cada(metricas_path)
+  progreso = Progreso(len(faltantes), 'documentos')
+
+  session = make_session(pool_size=max_downloads)
+  ritmo = Ritmo(tasa=ritmo_inicial, maxima=ritmo_maximo)
+  pares = zip(faltantes['cedula'], faltantes['iddoc'])
+
+  def descargados():
+    for cedula, iddoc, imgs in fetch_imgs(pares, session, max_workers=max_downloads, cache=cache, ritmo=ritmo):
+      # Not in the offline cache
+      if imgs is None:
+        print(f"Not cached cedula: {cedula}, and doc {iddoc}")
+        progreso.avanzar()
+        continue
+      # Failed downloads are not written, so they are tried again on restart
+      if 'error' in imgs:
+        print(f"Error downloading cedula: {cedula}, doc {iddoc}: {imgs['error']}")
+        progreso.avanzar()
+        continue
+      yield cedula, iddoc, imgs
+
+  def extraidos():
+    for r in ocr_imgs(descargados(), positions, n_workers=ocr_workers, roi=ocr_roi, extra_pages=extra_pages):
+      cedula, iddoc = r['cedula'], r['iddoc']
+      for k, v in ritmo.estado().items():
+        metricas.medir(f"ritmo_{k}", v)
+      progreso.avanzar(ritmo=f"{ritmo.estado()['tasa']}/s")
+
+      # Errors are not written, so they are tried again on restart
+      if 'error' in r:
+        print(f"Error with cedula: {cedula}, and doc {iddoc}: {r['error']}")
+        continue
+      elif len(r) == 2:
+        print(f"No doc for cedula: {cedula}, and doc {iddoc}")
+      yield r
+
+  for _ in write_chunks(extraidos(), here()/"data/temp/datos_contraloria", chunk_size=chunk_size):
+    pass
+  progreso.cerrar()
+  metricas.escribir(metricas_path)
+
+  # Save data
+  datos = a_categorias(compact_chunks(here()/"data/temp/datos_contraloria"))
+  datos.to_parquet(here()/"data/temp/datos_contraloria.parquet", index=False)
@@ -0,0 +1,55 @@
+"""
+Write the extracted fields in fixed-size parquet chunks, so a crash only loses the current chunk
+and a restart can skip the `(cedula, iddoc)` pairs already written.
+"""
+
+from pathlib import Path
+
+import pandas as pd
+
+
+def done_pairs(path) -> set:
+  """
+  Return the `(cedula, iddoc)` pairs stored in the chunks at path
+  """
+  pares = set()
+  for chunk in sorted(Path(path).glob('part-*.parquet')):
+    df = pd.read_parquet(chunk, columns=['cedula', 'iddoc'])
+    pares.update(zip(df['cedula'], df['iddoc']))
+  return pares
+
+
+def write_chunks(results, path, chunk_size:int=500):
+  """
+  Write the dicts in results to `path/part-NNNNN.parquet` every `chunk_size` rows.
+  Yields each result after it is buffered, so it can be used as the last step of a pipeline.
+  """
+  path = Path(path)
+  path.mkdir(parents=True, exist_ok=True)
+  n = len(list(path.glob('part-*.parquet')))
+
+  def flush(buffer):
+    nonlocal n
+    tmp = path/f"part-{n:05d}.tmp"
+    pd.DataFrame(buffer).to_parquet(tmp, index=False)
+    tmp.replace(path/f"part-{n:05d}.parquet")
+    n += 1
+
+  buffer = []
+  for r in results:
+    buffer.append(r)
+    if len(buffer) >= chunk_size:
+      flush(buffer)
+      buffer = []
+    yield r
+
+  if buffer:
+    flush(buffer)
+
+
+def compact_chunks(path) -> pd.DataFrame:
+  """
+  Join all the chunks at path into a single data frame
+  """
+  chunks = [pd.read_parquet(chunk) for chunk in sorted(Path(path).glob('part-*.parquet'))]
+  return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
@@ -0,0 +1,110 @@
+"""
+Functions to clean the dates extracted from the declaraciones
+"""
+
+import re
+import numpy as np
+import pandas as pd
+
+
+# OCR DATES ======================================================================
+
+# Characters tesseract confuses with digits
+confusiones = str.maketrans('ortz', '0112')
+
+# Years that are not fixed by the confusions
+cambiar_anio = {'201e': '2018', '20v4': '2014', 'n913': '2013', 'y000': '1990', 'y904': '1994', 'y00e': '1998',
+                'y080': '1989'}
+
+# Misread first two digits of the year
+cambiar_prefijo = {'79': '19', '30': '20'}
+
+# Layouts of the date: digits joined by separators, or XXXX-XX-XX with OCR letters.
+# Leading digits are kept in `patron_digitos` so the first 8 digits are the same as joining and searching `\d{8}`
+patron_digitos = re.compile(r'\d*(?:\d{4}[~\-.:\s]\d{2}[~\-.:\s]\d{2}|\d{4}[\-.:\s]\d{4}|\d{6}[\-.:\s]\d{2}|\d{8})')
+patron_letras = re.compile(r'\w{4}[~\-.:]\w{2}[~\-.:]\w{2}')
+patron_sep = re.compile(r'[~\-.:]')
+patron_no_digito = re.compile(r'\D')
+
+
+def fix_prefijo(s:str) -> str:
+  return cambiar_prefijo.get(s[:2], s[:2]) + s[2:]
+
+
+def parse_desde(desde) -> tuple:
+  """
+  Read an OCR date. Returns `(anio, mes, dia, nodash)` where nodash are the 8 digits of the
+  first date written with digits, and anio, mes and dia come from the first XXXX-XX-XX with OCR
+  letters (only when there is no nodash). Missing parts are None.
+  The digits are searched first over the whole string, since a XXXX-XX-XX to their left can
+  take some of them.
+  """
+  if not isinstance(desde, str):
+    return None, None, None, None
+
+  m = patron_digitos.search(desde)
+  if m is not None:
+    return None, None, None, fix_prefijo(patron_no_digito.sub('', m.group())[:8])
+
+  m = patron_letras.search(desde)
+  if m is None:
+    return None, None, None, None
+
+  anio, mes, dia = (x.translate(confusiones) for x in patron_sep.split(m.group()))
+  if anio.startswith('a'):
+    anio = '2' + anio[1:]
+  if anio.startswith('y99'):
+    anio = '199' + anio[3:]
+  anio = fix_prefijo(cambiar_anio.get(anio, anio))
+  return anio, mes, dia, None
+
+
+def parse_desde_col(desde:pd.Series) -> pd.DataFrame:
+  """
+  `parse_desde` over the distinct values of desde, as columns anio_str, mes_str, dia_str and from_nodash
+  """
+  codes, uniques = pd.factorize(desde)
+  partes = pd.DataFrame([parse_desde(u) for u in uniques] + [(None, None, None, None)],
+                        columns=['anio_str', 'mes_str', 'dia_str', 'from_nodash'])
+  return partes.fillna(np.nan).iloc[codes].set_index(desde.index)
+
+
+def validar_corpus(path) -> pd.DataFrame:
+  """
+  Compare `parse_desde` with the expected year-month of the desde values in the corpus at path.
+  Returns the rows that do not match.
+  """
+  corpus = pd.read_csv(path, dtype=str, keep_default_na=False)
+  partes = parse_desde_col(corpus['desde'])
+  fecha = partes['from_nodash'].fillna(partes['anio_str'] + partes['mes_str'] + partes['dia_str'])
+  corpus['resultado'] = fecha.str[:-2].fillna('')
+  return corpus.loc[corpus['resultado'] != corpus['fecha']]
+
+
+# GROUP MODES ======================================================================
+
+
+def group_modes(df:pd.DataFrame, keys:list, col:str) -> pd.DataFrame:
+  """
+  Mode of col within each group of keys, aligned with the rows of df:
+    - `unique_mode`: the mode if there is a single one, NaN otherwise
+    - `any_mode`: the smallest of the modes, as `Series.mode().iat[0]`
+    - `mode_count`: number of values tied as the mode (0 if the group has no values)
+  Computed with one count of `(keys, col)` pairs instead of a Python function per group.
+  """
+  counts = (df[keys + [col]]
+            .dropna(subset=[col])
+            .groupby(keys + [col], observed=True, sort=True)
+            .size()
+            .rename('n')
+            .reset_index()
+            )
+
+  # Keep the values tied as most frequent within each group, sorted by value
+  counts = counts.loc[counts['n'] == counts.groupby(keys, observed=True)['n'].transform('max')]
+  modes = counts.groupby(keys, observed=True, sort=False).agg(any_mode=(col, 'first'), mode_count=(col, 'size'))
+  modes['unique_mode'] = modes['any_mode'].where(modes['mode_count'] == 1)
+
+  res = df[keys].merge(modes.reset_index(), how='left', on=keys).set_index(df.index)
+  res['mode_count'] = res['mode_count'].fillna(0).astype(int)
+  return res[['unique_mode', 'any_mode', 'mode_count']]
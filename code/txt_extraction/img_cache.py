@@ -0,0 +1,144 @@
+"""
+On-disk cache of the declaration images. The png bytes are stored once per content hash in
+`blobs/` and an SQLite index maps `(cedula, iddoc, page)` to the hash. When the blobs go over
+`max_bytes` the least recently used declaraciones are evicted. Declaraciones without images are
+not cached, so they are asked again in the next run.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Mapping
+from pathlib import Path
+
+import numpy as np
+
+
+class BlobPages(Mapping):
+  """
+  Cached images of a declaracion as `{'img0': array, ...}`, like `img_funcs.LazyPages`: the blob
+  of a page is read only when the page is requested
+  """
+
+  def __init__(self, blobs:dict):
+    self.blobs = blobs
+    self.decoded = {}
+
+  def __len__(self):
+    return len(self.blobs)
+
+  def __iter__(self):
+    return iter(self.blobs)
+
+  def __getitem__(self, key:str) -> np.ndarray:
+    if key not in self.decoded:
+      self.decoded[key] = np.fromfile(self.blobs[key], np.uint8)
+    return self.decoded[key]
+
+
+class ImgCache:
+
+  def __init__(self, path, max_bytes:int=20 * 2**30, offline:bool=False):
+    self.path = Path(path)
+    (self.path/'blobs').mkdir(parents=True, exist_ok=True)
+    self.max_bytes = max_bytes
+    self.offline = offline
+    self.lock = threading.Lock()
+    self.con = sqlite3.connect(self.path/'index.sqlite', check_same_thread=False)
+    with self.con:
+      self.con.execute("CREATE TABLE IF NOT EXISTS docs (cedula TEXT, iddoc TEXT, used REAL, PRIMARY KEY (cedula, iddoc))")
+      self.con.execute("CREATE TABLE IF NOT EXISTS pages (cedula TEXT, iddoc TEXT, page INTEGER, sha TEXT, size INTEGER)")
+      self.con.execute("CREATE INDEX IF NOT EXISTS pages_doc ON pages (cedula, iddoc)")
+      self.con.execute("CREATE INDEX IF NOT EXISTS pages_sha ON pages (sha)")
+    # Bytes of the blobs in the index, updated by `put` and `evict`
+    self.total = self.size()
+
+  def blob(self, sha:str) -> Path:
+    return self.path/'blobs'/f"{sha}.png"
+
+  def get(self, cedula:str, iddoc:str):
+    """
+    Return the images of the declaracion as in `get_imgs`, or None if it is not cached
+    """
+    with self.lock:
+      if self.con.execute("SELECT 1 FROM docs WHERE cedula=? AND iddoc=?", (cedula, iddoc)).fetchone() is None:
+        return None
+      with self.con:
+        self.con.execute("UPDATE docs SET used=? WHERE cedula=? AND iddoc=?", (time.time(), cedula, iddoc))
+      pages = self.con.execute(
+        "SELECT page, sha FROM pages WHERE cedula=? AND iddoc=? ORDER BY page", (cedula, iddoc)
+      ).fetchall()
+
+    if len(pages) == 0:
+      return None
+    return BlobPages({f"img{page}": self.blob(sha) for page, sha in pages})
+
+  def put(self, cedula:str, iddoc:str, imgs:dict):
+    """
+    Store the output of `get_imgs`. Declaraciones without images are not stored.
+    """
+    datos, pages = {}, []
+    for key, img in imgs.items():
+      if isinstance(img, str):
+        continue
+      data = np.asarray(img).tobytes()
+      sha = hashlib.sha256(data).hexdigest()
+      datos[sha] = data
+      pages.append((cedula, iddoc, int(key[3:]), sha, len(data)))
+    if not pages:
+      return
+
+    with self.lock:
+      # Written with the lock held so `evict` cannot delete a blob before it is indexed
+      for sha, data in datos.items():
+        if not self.blob(sha).exists():
+          tmp = self.blob(sha).with_name(f"{sha}.{os.getpid()}.{threading.get_ident()}.tmp")
+          tmp.write_bytes(data)
+          tmp.replace(self.blob(sha))
+      viejos = dict(self.con.execute("SELECT sha, size FROM pages WHERE cedula=? AND iddoc=?", (cedula, iddoc)))
+      nuevos = {sha: size for _, _, _, sha, size in pages if not self.indexado(sha)}
+      with self.con:
+        self.con.execute("DELETE FROM pages WHERE cedula=? AND iddoc=?", (cedula, iddoc))
+        self.con.executemany("INSERT INTO pages VALUES (?, ?, ?, ?, ?)", pages)
+        self.con.execute("INSERT OR REPLACE INTO docs VALUES (?, ?, ?)", (cedula, iddoc, time.time()))
+      self.total += sum(nuevos.values())
+      self.borrar_huerfanos(viejos)
+    self.evict()
+
+  def indexado(self, sha:str) -> bool:
+    return self.con.execute("SELECT 1 FROM pages WHERE sha=?", (sha,)).fetchone() is not None
+
+  def borrar_huerfanos(self, sizes:dict):
+    """
+    Delete the blobs in `{sha: size}` that no declaracion points to. Call with the lock held.
+    """
+    for sha, size in sizes.items():
+      if self.indexado(sha):
+        continue
+      self.total -= size
+      self.blob(sha).unlink(missing_ok=True)
+
+  def size(self) -> int:
+    row = self.con.execute("SELECT SUM(size) FROM (SELECT DISTINCT sha, size FROM pages)").fetchone()
+    return row[0] or 0
+
+  def evict(self):
+    """
+    Remove the least recently used declaraciones until the blobs fit in `max_bytes`
+    """
+    with self.lock:
+      if self.total <= self.max_bytes:
+        return
+      viejos = self.con.execute("SELECT cedula, iddoc FROM docs ORDER BY used").fetchall()
+      for cedula, iddoc in viejos:
+        if self.total <= self.max_bytes:
+          break
+        sizes = dict(self.con.execute("SELECT sha, size FROM pages WHERE cedula=? AND iddoc=?", (cedula, iddoc)))
+        with self.con:
+          self.con.execute("DELETE FROM pages WHERE cedula=? AND iddoc=?", (cedula, iddoc))
+          self.con.execute("DELETE FROM docs WHERE cedula=? AND iddoc=?", (cedula, iddoc))
+
+        # Delete blobs no other declaracion points to
+        self.borrar_huerfanos(sizes)
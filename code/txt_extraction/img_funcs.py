@@ -0,0 +1,328 @@
+"""
+Functions to download the declaraciones and extract their fields
+"""
+
+import base64
+import io
+import re
+import time
+import warnings
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from PIL import Image, ImageOps
+
+import pytesseract
+from pytesseract import Output
+from ritmo import sin_ritmo
+from metricas import metricas
+from contraloria import contraloria_url
+
+pytesseract.pytesseract.tesseract_cmd = r'C:/Program Files/Tesseract-OCR/tesseract'
+
+
+# DOWNLOAD IMAGES ======================================================================
+
+# `src` attribute of the images in WFDeclaracionTemporal
+img_src = re.compile(rb"""<img\b[^>]*?\bsrc\s*=\s*["']([^"']*)["']""", flags=re.IGNORECASE)
+
+
+def make_session(pool_size:int=8, retries:int=3, backoff:float=0.5) -> requests.Session:
+  """
+  Keep-alive session with `pool_size` connections that retries failed requests with exponential backoff
+  """
+  retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=[429, 500, 502, 503, 504])
+  adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+  session = requests.Session()
+  session.mount('https://', adapter)
+  session.mount('http://', adapter)
+  session.verify = False
+  return session
+
+
+class LazyPages(Mapping):
+  """
+  Images of a WFDeclaracionTemporal page as `{'img0': array, 'img1': array, ...}`. The `src` of
+  each `<img>` is located with a regex and a page is base64-decoded only when it is requested.
+  """
+
+  def __init__(self, html:bytes):
+    self.html = html
+    self.spans = [m.span(1) for m in img_src.finditer(html)]
+    self.decoded = {}
+
+  def __len__(self):
+    return len(self.spans)
+
+  def __iter__(self):
+    return (f"img{idx}" for idx in range(len(self.spans)))
+
+  def __getitem__(self, key:str) -> np.ndarray:
+    idx = int(key[3:]) if key.startswith('img') and key[3:].isdigit() else -1
+    if not 0 <= idx < len(self.spans):
+      raise KeyError(key)
+    if idx not in self.decoded:
+      start, end = self.spans[idx]
+      imgdata = self.html[start:end]
+      imgdata = imgdata[imgdata.find(b',') + 1:]
+      self.decoded[idx] = np.frombuffer(base64.b64decode(imgdata), np.uint8)
+    return self.decoded[idx]
+
+
+# Status codes of an overloaded server
+estados_sobrecarga = {429, 500, 502, 503, 504}
+
+
+def get_imgs(cedula:str, declaracion:str, session=None, ritmo=sin_ritmo) -> dict:
+  """
+  Return a mapping containing the binary information of the images, see `LazyPages`.
+  A declaracion the server does not have is `{'img0': "No data"}`, an overloaded server
+  `{'error': "HTTP <status>"}`. Connection errors are raised.
+  The request is paced by ritmo (see `ritmo.Ritmo`), which is told about errors and overload.
+  """
+
+  # Get data
+  url = contraloria_url(f"/sistema/WFDeclaracionTemporal.aspx?xx=99&id={cedula}&td={declaracion}")
+  ritmo.esperar()
+  t0 = time.perf_counter()
+  with warnings.catch_warnings():
+    warnings.filterwarnings('ignore')
+    try:
+      if session is None:
+        r = requests.get(url, verify=False)
+      else:
+        r = session.get(url, timeout=30)
+    except requests.RequestException:
+      metricas.contar('descargas_total', estado='error')
+      ritmo.fallo()
+      raise
+
+  segundos = time.perf_counter() - t0
+  metricas.observar('descarga_segundos', segundos)
+
+  # Errors retried by the session also signal overload
+  reintentos = getattr(getattr(r.raw, 'retries', None), 'history', ())
+  metricas.contar('descarga_reintentos_total', len(reintentos))
+  if r.status_code in estados_sobrecarga or len(reintentos) > 0:
+    ritmo.fallo()
+  else:
+    ritmo.exito(segundos)
+  metricas.contar('descargas_total', estado='ok' if r.ok else str(r.status_code))
+
+  # Read data
+  if r.ok:
+    return LazyPages(r.content)
+
+  elif r.status_code in estados_sobrecarga:
+    return {'error': f"HTTP {r.status_code}"}
+
+  else:
+    return {'img0': "No data"}
+
+
+def cached_get_imgs(cedula:str, declaracion:str, session=None, cache=None, ritmo=sin_ritmo):
+  """
+  `get_imgs` going through `cache` (see `img_cache.ImgCache`) first. In offline mode a
+  declaracion that is not cached returns None without touching the network.
+  """
+  if cache is None:
+    return get_imgs(cedula, declaracion, session, ritmo)
+
+  imgs = cache.get(cedula, declaracion)
+  metricas.contar('cache_total', resultado='miss' if imgs is None else 'hit')
+  if imgs is None and not cache.offline:
+    imgs = get_imgs(cedula, declaracion, session, ritmo)
+    cache.put(cedula, declaracion, imgs)
+  return imgs
+
+
+def fetch_imgs(pares, session:requests.Session, max_workers:int=8, cache=None, ritmo=sin_ritmo):
+  """
+  Download the images of each `(cedula, iddoc)` in pares with `max_workers` threads.
+  At most `2*max_workers` downloads run ahead of the consumer, so the caller can run the OCR
+  of one document while the next ones are downloading. Yields `(cedula, iddoc, imgs)` in order,
+  with `imgs=None` for declaraciones missing from an offline cache and `imgs={'error': message}`
+  for failed downloads, which should not be recorded as documents without data.
+  Downloads are paced by ritmo.
+  """
+  def descargar(cedula, iddoc):
+    try:
+      return cached_get_imgs(cedula, iddoc, session, cache, ritmo)
+    except requests.RequestException as e:
+      return {'error': f"{type(e).__name__}: {e}"}
+
+  with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    pendientes = deque()
+    for cedula, iddoc in pares:
+      pendientes.append((cedula, iddoc, executor.submit(descargar, cedula, iddoc)))
+      if len(pendientes) >= 2 * max_workers:
+        cedula0, iddoc0, futuro = pendientes.popleft()
+        yield cedula0, iddoc0, futuro.result()
+
+    while pendientes:
+      cedula0, iddoc0, futuro = pendientes.popleft()
+      yield cedula0, iddoc0, futuro.result()
+
+
+# EXTRACT FIELDS ======================================================================
+
+
+def word_boxes(imagen, **kwargs) -> tuple:
+  """
+  Return the words found by tesseract and their boxes `[x0, y0, x1, y1]` as arrays
+  """
+  datos = pytesseract.image_to_data(imagen, output_type=Output.DICT, **kwargs)
+
+  # Keep only words
+  conf = np.asarray(datos['conf'], dtype=float)
+  keep = conf > 0
+  text = np.asarray(datos['text'], dtype=object)[keep]
+  x0 = np.asarray(datos['left'], dtype=np.int32)[keep]
+  y0 = np.asarray(datos['top'], dtype=np.int32)[keep]
+  x1 = x0 + np.asarray(datos['width'], dtype=np.int32)[keep]
+  y1 = y0 + np.asarray(datos['height'], dtype=np.int32)[keep]
+  return text, np.stack([x0, y0, x1, y1], axis=1)
+
+
+def assign_words(text:np.ndarray, boxes:np.ndarray, positions:dict) -> dict:
+  """
+  Join the words whose box lies inside each field of positions. All fields are compared
+  against all words at once: `inside[f, w]` is True if word w is inside field f.
+  """
+  campos = list(positions)
+  rect = np.asarray([positions[c] for c in campos]).reshape(-1, 4)
+  inside = (
+    (boxes[None, :, 0] >= rect[:, None, 0]) & (boxes[None, :, 1] >= rect[:, None, 1]) &
+    (boxes[None, :, 2] <= rect[:, None, 2]) & (boxes[None, :, 3] <= rect[:, None, 3])
+  )
+  return {campo: ' '.join(text[inside[i]]) for i, campo in enumerate(campos)}
+
+
+# Tesseract configuration of each field when reading only the boxes in positions
+fecha_profile = '--psm 7 -c tessedit_char_whitelist=0123456789-/.'
+field_profiles = {
+  'desde': fecha_profile,
+  'hasta': fecha_profile,
+  'institucion': '--psm 6',
+  'cargo': '--psm 6',
+}
+default_profile = '--psm 7'
+
+
+def gris_fondo_blanco(imagen):
+  """
+  Grayscale copy of imagen with the transparent pixels on white, as pytesseract fills them
+  """
+  if imagen.mode in ('RGBA', 'LA') or 'transparency' in imagen.info:
+    imagen = Image.alpha_composite(Image.new('RGBA', imagen.size, 'white'), imagen.convert('RGBA'))
+  return imagen.convert('L')
+
+
+def roi_to_data(imagen, positions, profiles:dict=None, margen:int=10) -> dict:
+  """
+  OCR only the box of each field, with the tesseract configuration of `profiles`
+  """
+  profiles = field_profiles if profiles is None else profiles
+  imagen = gris_fondo_blanco(imagen)
+
+  res = {}
+  for campo, (x0, y0, x1, y1) in positions.items():
+    recorte = ImageOps.expand(imagen.crop((x0, y0, x1, y1)), border=margen, fill='white')
+    texto = pytesseract.image_to_string(recorte, config=profiles.get(campo, default_profile))
+    res[campo] = ' '.join(texto.split())
+
+  return res
+
+
+# Define function to get data
+def img_to_data(imagen, positions, roi:bool=False) -> dict:
+  """
+  Convert image to data based on the positions. With `roi` only the boxes of the fields are read.
+  """
+  if roi:
+    return roi_to_data(imagen, positions)
+
+  text, boxes = word_boxes(imagen)
+  return assign_words(text, boxes, positions)
+
+
+def ocr_doc(cedula:str, iddoc:str, imgs:dict, positions:dict, roi:bool=False, extra_pages:dict=None) -> dict:
+  """
+  Extract the fields of the first image of a declaracion. `extra_pages` maps the index of a
+  later page to its positions; those fields are returned as `{field}_p{page}`. Errors are
+  returned in the `error` field so one bad document does not stop the rest. A page without
+  images is a declaracion without data, like `{'img0': "No data"}`.
+  """
+  imagen_bytes = imgs.get('img0', "No data")
+  if type(imagen_bytes) == str:
+    return {'cedula': cedula, 'iddoc': iddoc}
+
+  try:
+    r = img_to_data(Image.open(io.BytesIO(imagen_bytes)), positions, roi)
+    for page, page_positions in (extra_pages or {}).items():
+      if f"img{page}" not in imgs:
+        continue
+      imagen = Image.open(io.BytesIO(imgs[f"img{page}"]))
+      for campo, texto in img_to_data(imagen, page_positions, roi).items():
+        r[f"{campo}_p{page}"] = texto
+  except Exception as e:
+    r = {'error': f"{type(e).__name__}: {e}"}
+  r['cedula'] = cedula
+  r['iddoc'] = iddoc
+  return r
+
+
+def ocr_doc_cronometrado(*args) -> tuple:
+  """
+  `ocr_doc` and the seconds it took in the worker
+  """
+  t0 = time.perf_counter()
+  r = ocr_doc(*args)
+  return r, time.perf_counter() - t0
+
+
+def ocr_imgs(docs, positions:dict, n_workers:int=4, roi:bool=False, extra_pages:dict=None):
+  """
+  Run `ocr_doc` over `(cedula, iddoc, imgs)` items with `n_workers` processes.
+  Keeps at most `2*n_workers` documents in flight and yields the results in input order.
+  Only the pages that will be read are decoded and sent to the workers.
+  The OCR time of each document is recorded in the `ocr_segundos` histogram.
+  """
+  def resultado(futuro):
+    r, segundos = futuro.result()
+    estado = 'error' if 'error' in r else 'sin_doc' if len(r) == 2 else 'ok'
+    metricas.contar('ocr_docs_total', estado=estado)
+    if estado == 'ok':
+      metricas.observar('ocr_segundos', segundos)
+    return r
+
+  paginas = ['img0'] + [f"img{page}" for page in (extra_pages or {})]
+
+  with ProcessPoolExecutor(max_workers=n_workers) as executor:
+    pendientes = deque()
+    for cedula, iddoc, imgs in docs:
+      imgs = {key: imgs[key] for key in paginas if key in imgs}
+      pendientes.append(executor.submit(ocr_doc_cronometrado, cedula, iddoc, imgs, positions, roi, extra_pages))
+      if len(pendientes) >= 2 * n_workers:
+        yield resultado(pendientes.popleft())
+
+    while pendientes:
+      yield resultado(pendientes.popleft())
+
+
+def load_positions(path, sheet_name=0) -> dict:
+  """
+  Return `{field: [x0, y0, x1, y1]}` with the box that contains every position of the field
+  """
+  positions = pd.read_excel(path, sheet_name=sheet_name)
+  positions = positions.groupby('field').agg(x0=('x0', 'min'), y0=('y0', 'min'), x1=('x1', 'max'), y1=('y1', 'max'))
+
+  # Convert ot dictionary
+  positions['pos'] = positions[['x0', 'y0', 'x1', 'y1']].apply(lambda row: list(row), axis=1)
+  return positions[['pos']].to_dict()['pos']